@@ -0,0 +1,289 @@
+import argparse
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Timing the different stages of a script, to find out which one is slow.
+#
+# Mark functions with the @profile decorator, or parts of a function with
+#     with profiling.stage('network'):
+#         ...
+# Nothing is measured unless profiling is switched on (with enable(), or
+# from the command line, see from_command_line()): until then, the decorator
+# and stage() only cost a check of the enabled flag.
+#
+# When it's on, each stage records its number of calls, total time, bytes
+# read and written by the process (Linux only, from /proc/self/io), and
+# optionally peak memory (tracemalloc, which makes everything slower).
+# Stages inside other stages are recorded separately, e.g.
+#     cached_efficiency;calculate_efficiency;first_fit_many
+# so the report can be drawn as a flame graph.
+#
+# Only the current process is measured: work done in worker processes
+# (e.g. ProcessPoolExecutor) just shows up as time in the stage waiting for it.
+# Stages in other threads start their own stack, and their bytes and memory
+# include whatever the other threads are doing at the same time.
+
+enabled = False
+track_memory = False
+
+# {stage path (tuple of names): {'calls', 'wall_time', 'bytes_read', 'bytes_written', 'peak_memory'}}
+stats = {}
+stats_lock = threading.Lock()
+
+# Stages currently running, in each thread
+running = threading.local()
+
+# /proc/self/io, opened once when profiling is enabled (None if not available)
+io_file = None
+io_bytes_read_by_us = 0
+io_lock = threading.Lock()
+
+
+def enable(memory=False):
+    '''
+    Switch profiling on (with memory=True, also track peak memory with tracemalloc).
+    '''
+    global enabled, track_memory, io_file
+    enabled = True
+    track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if io_file is None:
+        try:
+            io_file = os.open('/proc/self/io', os.O_RDONLY)
+        except OSError:
+            io_file = None
+
+
+def disable():
+    global enabled
+    enabled = False
+    if track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    with stats_lock:
+        stats.clear()
+
+
+def io_counters():
+    '''
+    Total bytes read and written by this process so far (files, network, pipes...),
+    or (0, 0) if the operating system doesn't tell us.
+    '''
+    global io_bytes_read_by_us
+    if io_file is None:
+        return 0, 0
+
+    with io_lock:
+        raw = os.pread(io_file, 1024, 0)
+        counters = dict(line.split(b': ') for line in raw.splitlines())
+
+        # Don't count reading /proc/self/io itself
+        bytes_read = int(counters[b'rchar']) - io_bytes_read_by_us
+        io_bytes_read_by_us += len(raw)
+
+    return bytes_read, int(counters[b'wchar'])
+
+
+class Stage():
+    '''
+    Context manager measuring one run of a stage (see stage()).
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if not hasattr(running, 'stack'):
+            running.stack = []
+        stack = running.stack
+
+        if track_memory:
+            # The peak for the stage we're in so far, before we start counting ours
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+            self.peak = current
+
+        self.path = (stack[-1].path if stack else ()) + (self.name,)
+        stack.append(self)
+
+        self.start_io = io_counters()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        wall_time = time.perf_counter() - self.start_time
+        end_io = io_counters()
+
+        stack = running.stack
+        stack.pop()
+
+        peak_memory = 0
+        if track_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_memory = self.peak - self.start_memory
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            tracemalloc.reset_peak()
+
+        with stats_lock:
+            s = stats.setdefault(self.path, {'calls': 0, 'wall_time': 0.0, 'bytes_read': 0,
+                                             'bytes_written': 0, 'peak_memory': 0})
+            s['calls'] += 1
+            s['wall_time'] += wall_time
+            s['bytes_read'] += end_io[0] - self.start_io[0]
+            s['bytes_written'] += end_io[1] - self.start_io[1]
+            s['peak_memory'] = max(s['peak_memory'], peak_memory)
+
+        # Don't hide exceptions
+        return False
+
+
+# What stage() gives when profiling is off (does nothing, can be used again and again)
+no_stage = contextlib.nullcontext()
+
+
+def stage(name):
+    '''
+    Context manager to measure a part of a function as its own stage, e.g.
+        with profiling.stage('network'):
+            r = requests.get(url)
+    '''
+    if not enabled:
+        return no_stage
+    return Stage(name)
+
+
+def profile(function=None, name=None):
+    '''
+    Decorator to measure each call of a function as a stage
+    (named after the function, unless name is given):
+        @profiling.profile
+        def first_fit(...):
+    '''
+    if function is None:
+        return functools.partial(profile, name=name)
+
+    stage_name = function.__name__ if name is None else name
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        with Stage(stage_name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def report():
+    '''
+    Everything recorded so far, as a list of dictionaries (one per stage),
+    with the time spent in each stage itself (self_time, i.e. not counting
+    the stages inside it).
+    '''
+    with stats_lock:
+        recorded = {path: dict(s) for path, s in stats.items()}
+
+    rows = []
+    for path, s in sorted(recorded.items()):
+        children_time = sum(c['wall_time'] for p, c in recorded.items() if p[:-1] == path)
+        rows.append(dict(stage=';'.join(path), **s, self_time=max(s['wall_time'] - children_time, 0.0)))
+    return rows
+
+
+def save_report(filename):
+    '''
+    Save the report as JSON (if filename ends in .json), or otherwise
+    in the "folded stacks" format read by flamegraph.pl and speedscope:
+    one line per stage, with its self time in microseconds.
+    '''
+    rows = report()
+    with open(filename, 'w') as f:
+        if filename.endswith('.json'):
+            json.dump(rows, f, indent=2)
+        else:
+            for row in rows:
+                f.write(f'{row["stage"]} {round(row["self_time"] * 1e6)}\n')
+
+
+def print_report():
+    print(f'{"stage":<60} {"calls":>8} {"time (s)":>10} {"self (s)":>10} {"read (MB)":>10} {"written (MB)":>12} {"peak (MB)":>10}')
+    for row in report():
+        print(f'{row["stage"]:<60} {row["calls"]:>8} {row["wall_time"]:>10.3f} {row["self_time"]:>10.3f} '
+              f'{row["bytes_read"] / 1e6:>10.2f} {row["bytes_written"] / 1e6:>12.2f} {row["peak_memory"] / 1e6:>10.2f}')
+
+
+def from_command_line(argv=None):
+    '''
+    Switch profiling on if the script was run with
+        python script.py --profile report.json [--profile-memory]
+    and save the report (and print a summary) when the script ends.
+    Other command line arguments are left alone.
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='save a profiling report (.json, or folded stacks for a flame graph)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='also record peak memory for each stage (slower)')
+    options, _ = parser.parse_known_args(argv)
+
+    if options.profile is not None:
+        enable(memory=options.profile_memory)
+        atexit.register(print_report)
+        atexit.register(save_report, options.profile)
+
+
+def test_profiling():
+    '''
+    Convenience function to test the stage measurements.
+    '''
+    @profile
+    def outer():
+        for i in range(3):
+            inner()
+        with stage('write'):
+            with open('test_profiling.tmp', 'wb') as f:
+                f.write(b'x' * 1_000_000)
+
+    @profile(name='renamed')
+    def inner():
+        big = bytearray(10_000_000)
+        time.sleep(0.01)
+        return len(big)
+
+    # Nothing recorded when profiling is off
+    reset()
+    outer()
+    assert not stats
+
+    enable(memory=True)
+    outer()
+    disable()
+    os.remove('test_profiling.tmp')
+
+    rows = {row['stage']: row for row in report()}
+    assert set(rows) == {'outer', 'outer;renamed', 'outer;write'}
+    assert rows['outer;renamed']['calls'] == 3 and rows['outer;renamed']['wall_time'] >= 0.03
+    assert rows['outer']['self_time'] < rows['outer']['wall_time']
+    assert rows['outer;renamed']['peak_memory'] >= 10_000_000
+    assert rows['outer']['peak_memory'] >= rows['outer;renamed']['peak_memory']
+    if io_file is not None:
+        assert rows['outer;write']['bytes_written'] >= 1_000_000
+    reset()
+    print('Test passed.')
+
+
+if __name__ == '__main__':
+    test_profiling()
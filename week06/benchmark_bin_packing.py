@@ -0,0 +1,170 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+import bin_packing as bp
+
+# Benchmarks for the packing functions in bin_packing.py.
+# Run from the week06 folder, e.g.
+#     python benchmark_bin_packing.py --output bench.json
+# then, after changing something:
+#     python benchmark_bin_packing.py --output bench_new.json --baseline bench.json
+# to see which cases got slower.
+
+# Packing functions to benchmark, with the largest number of items
+# we're prepared to wait for (first_fit() checks every bin for every item!)
+ENGINES = {'first_fit': (bp.first_fit, 10**4),
+           'first_fit_fast': (bp.first_fit_fast, 10**6),
+           'best_fit': (bp.best_fit, 10**6),
+           'worst_fit': (bp.worst_fit, 10**6),
+           'next_fit': (bp.next_fit, 10**6),
+           'compare_efficiency': (None, 10**6)}
+
+
+def generate_items(distribution, number_of_items, max_item_size=10, seed=0):
+    '''
+    Generate a list of items with sizes between 0 and max_item_size.
+    Distribution can be:
+        'uniform': same as generate_test_data() in bin_packing.py
+        'skewed': mostly small items, with a few big ones
+        'nearly_full': every item takes up 80-100% of a bin
+    '''
+    rng = np.random.default_rng(seed)
+
+    if distribution == 'uniform':
+        items = max_item_size * rng.random(number_of_items)
+    elif distribution == 'skewed':
+        items = max_item_size * rng.random(number_of_items) ** 3
+    elif distribution == 'nearly_full':
+        items = max_item_size * (0.8 + 0.2 * rng.random(number_of_items))
+    else:
+        raise ValueError(f'distribution is {distribution}, should be "uniform", "skewed", or "nearly_full".')
+
+    return items
+
+
+def run_once(engine, items, max_item_size, method):
+    '''
+    Pack the items once with the chosen engine.
+    'compare_efficiency' packs the items as sets of 50 items
+    (like in bin_packing.py), with all 3 methods at once.
+    '''
+    if engine == 'compare_efficiency':
+        number_of_items = min(50, items.size)
+        item_sets = items[:items.size // number_of_items * number_of_items].reshape(-1, number_of_items)
+        bin_sizes = max_item_size * np.ones(item_sets.shape[0])
+        bp.compare_efficiency(item_sets, bin_sizes)
+    else:
+        function = ENGINES[engine][0]
+        function(items, max_item_size, method=method)
+
+
+def benchmark_case(engine, distribution, method, number_of_items, max_item_size=10, repeats=3):
+    '''
+    Time one benchmark case: best wall time over a few repeats,
+    then one more run with tracemalloc to measure peak memory.
+    '''
+    items = generate_items(distribution, number_of_items, max_item_size)
+
+    # Fewer repeats for the big cases
+    repeats = max(1, min(repeats, 10**5 // number_of_items))
+
+    times = []
+    for r in range(repeats):
+        start = time.perf_counter()
+        run_once(engine, items, max_item_size, method)
+        times.append(time.perf_counter() - start)
+    wall_time = min(times)
+
+    tracemalloc.start()
+    run_once(engine, items, max_item_size, method)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'engine': engine,
+            'distribution': distribution,
+            'method': method,
+            'number_of_items': number_of_items,
+            'wall_time': wall_time,
+            'items_per_sec': number_of_items / wall_time,
+            'peak_memory': peak}
+
+
+def run_benchmarks(engines, distributions, methods, sizes, repeats=3):
+    '''
+    Run every combination of engine, distribution, method and number of items,
+    printing the results as we go.
+    '''
+    results = []
+
+    for engine in engines:
+        for distribution in distributions:
+            # compare_efficiency() always runs all 3 methods
+            for method in (['all'] if engine == 'compare_efficiency' else methods):
+                for n in sizes:
+                    if n > ENGINES[engine][1]:
+                        continue
+
+                    result = benchmark_case(engine, distribution, method, n, repeats=repeats)
+                    results.append(result)
+                    print(f'{engine:>20} {distribution:>12} {method:>10} {n:>8}: '
+                          f'{result["wall_time"]:10.4f} s, {result["items_per_sec"]:12.0f} items/s, '
+                          f'{result["peak_memory"] / 1e6:8.2f} MB')
+
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    '''
+    Compare wall times with a baseline (a list of results from a previous run).
+    Returns the cases which are more than tolerance (e.g. 25%) slower.
+    '''
+    def key(r):
+        return (r['engine'], r['distribution'], r['method'], r['number_of_items'])
+
+    baseline_times = {key(r): r['wall_time'] for r in baseline}
+
+    regressions = []
+    for r in results:
+        if key(r) in baseline_times and r['wall_time'] > (1 + tolerance) * baseline_times[key(r)]:
+            regressions.append((r, baseline_times[key(r)]))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the bin packing functions in bin_packing.py.')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--distributions', nargs='+', default=['uniform', 'skewed', 'nearly_full'])
+    parser.add_argument('--methods', nargs='+', default=['decreasing', 'increasing', 'none'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10**4, 10**5, 10**6])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='bench_bin_packing.json', help='JSON file to save the results in')
+    parser.add_argument('--baseline', help='JSON file from a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slowdown flagged as a regression (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.engines, args.distributions, args.methods, args.sizes, args.repeats)
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'results': results}, f, indent=2)
+    print(f'Results saved in {args.output}.')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for r, baseline_time in regressions:
+            print(f'Slower: {r["engine"]} {r["distribution"]} {r["method"]} {r["number_of_items"]}: '
+                  f'{r["wall_time"]:.4f} s vs. {baseline_time:.4f} s')
+
+        if regressions:
+            raise SystemExit(f'{len(regressions)} regression(s) compared to {args.baseline}.')
+        print('No regressions.')
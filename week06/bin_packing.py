@@ -1,11 +1,47 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import contextlib
+import hashlib
+import heapq
+import json
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from types import SimpleNamespace
 
-# Setting the font size for all plots
-# https://matplotlib.org/stable/users/explain/customizing.html#runtime-rc-settings
-import matplotlib as mpl
-mpl.rcParams['font.size'] = 18
+# profiling.py is shared by all the weeks, in the folder above this one.
+# Without it (e.g. if this folder is copied on its own), nothing is measured.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import profiling
+except ImportError:
+    profiling = SimpleNamespace(profile=lambda function: function,
+                                stage=lambda name: contextlib.nullcontext(),
+                                from_command_line=lambda argv=None: None)
 
+# Matplotlib is only imported in plot_efficiency(), when we actually plot something,
+# so that importing this module just to pack items stays quick.
+
+def sort_items(item_list, method='decreasing'):
+    '''
+    Sort items before binning, according to the chosen method.
+    Can be 'increasing', 'decreasing', or 'none' (keep the original order).
+    '''
+    # Sort items by decreasing size
+    if method == 'decreasing':
+        sorted_items = sorted(item_list, reverse=True)
+    elif method == 'increasing':
+        sorted_items = sorted(item_list)
+    elif method == 'none':
+        sorted_items = item_list.copy()
+    else:
+        raise ValueError(f'method is {method}, should be "increasing", "decreasing", or "none".')
+
+    return sorted_items
+
+
+@profiling.profile
 def first_fit(item_list, bin_size, method='decreasing'):
     '''
     First-fit algorithm for the bin packing problem.
@@ -21,15 +57,8 @@ def first_fit(item_list, bin_size, method='decreasing'):
     # Start a list of bins
     bins = [0]
 
-    # Sort items by decreasing size
-    if method == 'decreasing':
-        sorted_items = sorted(item_list, reverse=True)
-    elif method == 'increasing':
-        sorted_items = sorted(item_list)
-    elif method == 'none':
-        sorted_items = item_list.copy()
-    else:
-        raise ValueError(f'method is {method}, should be "increasing", "decreasing", or "none".')
+    # Sort items (or not) according to the chosen method
+    sorted_items = sort_items(item_list, method)
 
     # Loop over the items
     for item in sorted_items:
@@ -55,6 +84,550 @@ def first_fit(item_list, bin_size, method='decreasing'):
     return bins
 
 
+def best_fit(item_list, bin_size, method='decreasing'):
+    '''
+    Best-fit algorithm for the bin packing problem: each item goes in
+    the fullest bin where it still fits.
+    The open bins are kept in a SortedList (from the sortedcontainers package)
+    sorted by fill level, so that we can find that bin with a binary search
+    instead of checking all of them.
+
+    Input and output are the same as first_fit().
+    '''
+    from sortedcontainers import SortedList
+
+    bins = [0]
+
+    # Open bins as (fill level, bin index), sorted by fill level
+    by_fill = SortedList([(0, 0)])
+
+    for item in sort_items(item_list, method):
+
+        # Number of bins where the item fits: those with fill level <= bin_size - item.
+        # bin_size - item is rounded, so nudge i until it agrees with
+        # the item + fill <= bin_size test used in first_fit().
+        i = by_fill.bisect_right((bin_size - item, len(bins)))
+        while i < len(by_fill) and item + by_fill[i][0] <= bin_size:
+            i += 1
+        while i > 0 and item + by_fill[i - 1][0] > bin_size:
+            i -= 1
+
+        if i > 0:
+            # The fullest bin where the item fits (the first one, if there's a tie)
+            i = by_fill.bisect_left((by_fill[i - 1][0], -1))
+            fill, b = by_fill.pop(i)
+            bins[b] += item
+        else:
+            # Start a new bin
+            b = len(bins)
+            bins.append(item)
+
+        by_fill.add((bins[b], b))
+
+    return bins
+
+
+def worst_fit(item_list, bin_size, method='decreasing'):
+    '''
+    Worst-fit algorithm for the bin packing problem: each item goes in
+    the emptiest bin, or in a new bin if it doesn't fit there.
+    The open bins are kept in a heap, so the emptiest one is always at the top.
+
+    Input and output are the same as first_fit().
+    '''
+    bins = [0]
+
+    # Open bins as (fill level, bin index), emptiest first
+    by_fill = [(0, 0)]
+
+    for item in sort_items(item_list, method):
+        fill, b = by_fill[0]
+
+        if item + fill <= bin_size:
+            bins[b] += item
+            heapq.heapreplace(by_fill, (bins[b], b))
+        else:
+            # Start a new bin
+            b = len(bins)
+            bins.append(item)
+            heapq.heappush(by_fill, (item, b))
+
+    return bins
+
+
+def next_fit(item_list, bin_size, method='decreasing'):
+    '''
+    Next-fit algorithm for the bin packing problem: only the last bin is open.
+    Each item goes in it if it fits, otherwise we start a new bin.
+
+    Input and output are the same as first_fit().
+    '''
+    bins = [0]
+
+    for item in sort_items(item_list, method):
+        if item + bins[-1] <= bin_size:
+            bins[-1] += item
+        else:
+            bins.append(item)
+
+    return bins
+
+
+def packing_metric(bins_used, total_fill, bin_sizes, metric='number_of_bins'):
+    '''
+    Calculate the packing efficiency from the number of bins used and the total
+    size of the items packed (single numbers, or arrays with one value per item set).
+
+    Choose metric between number of bins and % empty space.
+    '''
+    if metric == 'number_of_bins':
+        # Count number of bins used
+        return bins_used
+
+    elif metric == 'empty_space':
+        # Calculate the % of empty space across all bins
+        # (this is more useful if the bin size is randomised, as it's normalised)
+        total_bin_space = bin_sizes * bins_used
+        return 100 * (total_bin_space - total_fill) / total_bin_space
+
+    else:
+        raise ValueError(f'metric should be "number_of_bins" or "empty_space", not {metric}.')
+
+
+class PackingResult():
+    '''
+    Result of packing one list of items, stored in Numpy arrays
+    which are allocated once, with room for one bin per item plus
+    the empty bin first_fit() starts with (if every item is bigger than
+    the bin size, that first bin stays empty and each item gets its own).
+
+    Attributes:
+        bin_size (float): capacity of each bin
+        fill (array of float64): fill level of each bin
+        assignment (array of int32): index of the bin each item was placed in,
+            in the original order of the items
+        count (array of int32): number of items in each bin
+        bins_used (int): number of bins used; only the first bins_used
+            entries of fill and count are meaningful.
+    '''
+
+    def __init__(self, number_of_items, bin_size):
+        self.bin_size = bin_size
+        self.fill = np.zeros(number_of_items + 1, dtype=np.float64)
+        self.assignment = np.full(number_of_items, -1, dtype=np.int32)
+        self.count = np.zeros(number_of_items + 1, dtype=np.int32)
+
+        # Same as bins = [0] in first_fit()
+        self.bins_used = 1
+
+    def fill_levels(self):
+        '''
+        Fill level of each bin used (same as the output of first_fit()).
+        '''
+        return self.fill[:self.bins_used]
+
+    def item_counts(self):
+        '''
+        Number of items in each bin used.
+        '''
+        return self.count[:self.bins_used]
+
+    def number_of_bins(self):
+        return self.bins_used
+
+    def empty_space(self):
+        '''
+        % of empty space across all bins used.
+        '''
+        return packing_metric(self.bins_used, self.fill_levels().sum(), self.bin_size, metric='empty_space')
+
+    def efficiency(self, metric='number_of_bins'):
+        '''
+        Packing efficiency, as used in compare_efficiency().
+        '''
+        return packing_metric(self.bins_used, self.fill_levels().sum(), self.bin_size, metric)
+
+
+class FillTree():
+    '''
+    Segment tree over the fill levels of a row of bins, to find the first bin
+    where an item fits in O(log(number of bins)) instead of checking every
+    bin in turn (used by first_fit_packing() and StreamingPacker).
+
+    Each node of the tree stores the lowest fill level of the bins below it:
+    if the item doesn't fit on top of that, it doesn't fit in any of them.
+    Bins which haven't been opened yet are leaves with a fill level of 0,
+    to the right of all the open bins, so "start a new bin" is just
+    "the first bin where the item fits" as well. A closed bin is set to
+    infinity, so nothing fits in it any more.
+
+    The tree is an array.array of floats (8 bytes per node, like a Numpy
+    array), rather than a list: a list of floats takes about 4 times as much
+    memory, and is only 20-40% faster to read and write.
+
+    Input:
+        number_of_bins (int): number of bins (leaves) the tree has room for
+        bin_size (float): capacity of each bin
+    '''
+
+    def __init__(self, number_of_bins, bin_size):
+        self.bin_size = bin_size
+
+        # Number of leaves: the smallest power of 2 with one leaf per bin
+        self.size = 1
+        while self.size < number_of_bins:
+            self.size *= 2
+
+        # tree[1] is the root, the children of node i are 2*i and 2*i + 1,
+        # and the leaves (the bins themselves) are tree[size:]
+        self.tree = array('d', [0.0]) * (2 * self.size)
+
+    def first_fit(self, item):
+        '''
+        Index of the first bin where the item fits, or -1 if it doesn't fit anywhere.
+        '''
+        tree = self.tree
+        if item + tree[1] > self.bin_size:
+            return -1
+
+        # Walk down the tree, going left whenever the item fits there
+        node = 1
+        while node < self.size:
+            node *= 2
+            if item + tree[node] > self.bin_size:
+                node += 1
+        return node - self.size
+
+    def place(self, item, new_bin):
+        '''
+        Put the item in the first bin where it fits (or in bin new_bin,
+        if it doesn't fit anywhere), and return the index of that bin.
+        Same as first_fit() then set_fill(), in one go (this is the inner loop
+        of first_fit_packing(), so it's worth saving the extra method calls).
+        '''
+        tree = self.tree
+        size = self.size
+        bin_size = self.bin_size
+
+        if item + tree[1] <= bin_size:
+            node = 1
+            while node < size:
+                node *= 2
+                if item + tree[node] > bin_size:
+                    node += 1
+        else:
+            node = new_bin + size
+        b = node - size
+
+        tree[node] += item
+        node //= 2
+        while node >= 1:
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if left < right else right
+            node //= 2
+
+        return b
+
+    def fill(self, b):
+        return self.tree[b + self.size]
+
+    def set_fill(self, b, fill):
+        '''
+        Change the fill level of bin b, and update the lowest fill levels
+        on the way back up to the root.
+        '''
+        tree = self.tree
+        node = b + self.size
+        tree[node] = fill
+
+        node //= 2
+        while node >= 1:
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if left < right else right
+            node //= 2
+
+    def fill_levels(self, number_of_bins):
+        '''
+        Fill levels of the first number_of_bins bins, as a Numpy array (a view, not a copy).
+        '''
+        return np.frombuffer(self.tree, dtype=np.float64)[self.size:self.size + number_of_bins]
+
+
+def first_fit_packing(item_list, bin_size, method='decreasing', chunk_size=4096):
+    '''
+    Same as first_fit(), but keeps the bins in a segment tree (see FillTree)
+    so that finding the first bin where an item fits takes O(log(number of bins))
+    instead of checking every open bin in turn.
+
+    Memory: apart from the result, the tree takes 8 bytes per node (at most
+    4 nodes per item), plus the sorted items and their order (16 bytes per item);
+    the items are only turned into Python floats chunk_size at a time.
+
+    Input is the same as first_fit().
+    Output:
+        result (PackingResult): fill level of each bin, plus which bin
+            each item went into, and how many items are in each bin.
+    '''
+    items = np.asarray(item_list, dtype=np.float64)
+    number_of_items = items.size
+
+    # Sort the items, but remember where each one came from
+    if method == 'decreasing':
+        order = np.argsort(-items, kind='stable')
+    elif method == 'increasing':
+        order = np.argsort(items, kind='stable')
+    elif method == 'none':
+        order = np.arange(number_of_items)
+    else:
+        raise ValueError(f'method is {method}, should be "increasing", "decreasing", or "none".')
+
+    result = PackingResult(number_of_items, bin_size)
+
+    # One bin per item, plus the first bin, which stays empty
+    # if every item is bigger than the bin size
+    tree = FillTree(number_of_items + 1, bin_size)
+
+    for start in range(0, number_of_items, chunk_size):
+        chunk_order = order[start:start + chunk_size]
+        chunk_assignment = np.empty(chunk_order.size, dtype=np.int32)
+
+        for k, item in enumerate(items[chunk_order].tolist()):
+            # (an item bigger than the bin size goes in a new bin on its own)
+            b = tree.place(item, result.bins_used)
+            chunk_assignment[k] = b
+            if b == result.bins_used:
+                result.bins_used += 1
+
+        result.assignment[chunk_order] = chunk_assignment
+        np.add.at(result.count, chunk_assignment, 1)
+
+    result.fill[:result.bins_used] = tree.fill_levels(result.bins_used)
+
+    return result
+
+
+def first_fit_fast(item_list, bin_size, method='decreasing'):
+    '''
+    Same as first_fit(), using the segment tree from first_fit_packing().
+    Input and output are the same as first_fit().
+    '''
+    return first_fit_packing(item_list, bin_size, method).fill_levels().tolist()
+
+
+@profiling.profile
+def first_fit_many(item_sets, bin_sizes, method='decreasing'):
+    '''
+    First-fit algorithm for many item sets at once.
+    Each row of item_sets is packed exactly as first_fit() would,
+    but all the rows are packed together with Numpy array operations,
+    one item position at a time.
+
+    Input:
+        item_sets (array): 2D array, one item set per row
+        bin_sizes (array): capacity of the bins for each item set
+        method (str): sorting (or not) of items before
+            binning. Can be 'increasing', 'decreasing', or 'none'.
+
+    Output:
+        bins_used (array): number of bins used for each item set
+        bins (array): 2D array with the fill level of each bin for each item set
+            (bins[i, :bins_used[i]] is the same as first_fit() for row i,
+            the rest of the row is 0).
+    '''
+    item_sets = np.asarray(item_sets, dtype=float)
+    bin_sizes = np.asarray(bin_sizes, dtype=float)
+    number_of_sets, number_of_items = item_sets.shape
+
+    if bin_sizes.shape != (number_of_sets,):
+        raise ValueError(f'Got {number_of_sets} item sets but {bin_sizes.size} bin sizes.')
+
+    # Sort every row at once
+    if method == 'decreasing':
+        sorted_items = np.sort(item_sets, axis=1)[:, ::-1]
+    elif method == 'increasing':
+        sorted_items = np.sort(item_sets, axis=1)
+    elif method == 'none':
+        sorted_items = item_sets
+    else:
+        raise ValueError(f'method is {method}, should be "increasing", "decreasing", or "none".')
+
+    # first_fit() always starts with 1 bin, which stays empty if every item
+    # is bigger than the bin size, so we need at most one bin more than items
+    bins = np.zeros((number_of_sets, number_of_items + 1))
+    bins_used = np.ones(number_of_sets, dtype=int)
+    rows = np.arange(number_of_sets)
+
+    # Loop over the item positions, placing the current item of every set
+    for k in range(number_of_items):
+        items = sorted_items[:, k]
+
+        # Does the item fit in each bin? Bins not opened yet have a fill level of 0.
+        fits = items[:, np.newaxis] + bins <= bin_sizes[:, np.newaxis]
+
+        # Index of the first bin where it fits
+        # (or a new bin, if the item is bigger than the bin size)
+        b = np.where(fits.any(axis=1), fits.argmax(axis=1), bins_used)
+
+        # Place the items
+        bins[rows, b] += items
+        bins_used = np.maximum(bins_used, b + 1)
+
+    return bins_used, bins
+
+
+class StreamingPacker():
+    '''
+    First-fit bin packing for items which arrive one at a time
+    (e.g. from a feed), so we can't sort them or see them all up front.
+    Gives the same bins as first_fit(item_list, bin_size, method='none'),
+    as long as no bins are closed early by max_open_bins.
+
+    The open bins are kept in a FillTree (as in first_fit_packing()), so
+    each item takes O(log(number of open bins)) to place, however long the stream.
+
+    Input:
+        bin_size (float): capacity of each bin
+        min_item_size (float or None): size of the smallest item we expect.
+            If given, a bin is closed (and forgotten) as soon as an item of that
+            size can't fit in it any more. This doesn't change where items go.
+        max_open_bins (int or None): if given, never keep more than this many
+            bins open: when a new bin is needed, the oldest open bin is closed
+            first. This keeps memory bounded on an endless stream, but items
+            can then end up in a new bin when first_fit() would have put them
+            in an old one. Without it, bins with room left for items of
+            min_item_size (but not for the items which actually arrive)
+            stay open forever.
+    '''
+
+    def __init__(self, bin_size, min_item_size=None, max_open_bins=None):
+        if max_open_bins is not None and max_open_bins < 1:
+            raise ValueError(f'max_open_bins should be at least 1, not {max_open_bins}.')
+
+        self.bin_size = bin_size
+        self.min_item_size = min_item_size
+        self.max_open_bins = max_open_bins
+
+        # Each open bin has a slot (a leaf) in the tree, in the order the bins
+        # were opened. open_bins maps bin index -> slot; dictionaries keep their
+        # insertion order, so it is always sorted by bin index and by slot.
+        # Closed slots are set to infinity; when we run out of slots,
+        # the open bins are moved to the start of a new tree.
+        self.tree = FillTree(2 if max_open_bins is None else 2 * max_open_bins, bin_size)
+        self.slot_bins = []
+
+        # Start with one empty bin, like first_fit()
+        self.open_bins = {}
+        self.number_of_bins = 0
+        self.open_bin()
+        self.closed_bins = 0
+        self.number_of_items = 0
+
+    def open_bin(self):
+        '''
+        Open a new (empty) bin, closing the oldest one first if we're
+        at max_open_bins, and return its slot in the tree.
+        '''
+        if self.max_open_bins is not None and len(self.open_bins) >= self.max_open_bins:
+            self.close_bin(next(iter(self.open_bins)))
+
+        if len(self.slot_bins) == self.tree.size:
+            self.compact()
+
+        slot = len(self.slot_bins)
+        self.slot_bins.append(self.number_of_bins)
+        self.open_bins[self.number_of_bins] = slot
+        self.number_of_bins += 1
+        return slot
+
+    def close_bin(self, b):
+        self.tree.set_fill(self.open_bins.pop(b), float('inf'))
+        self.closed_bins += 1
+
+    def compact(self):
+        '''
+        Move the open bins to the start of a new tree, with room for
+        at least as many new bins as there are open bins.
+        '''
+        fills = [self.tree.fill(slot) for slot in self.open_bins.values()]
+        number_of_slots = 2 * max(len(fills), 1) if self.max_open_bins is None else 2 * self.max_open_bins
+        self.tree = FillTree(number_of_slots, self.bin_size)
+        self.slot_bins = list(self.open_bins)
+
+        for slot, (b, fill) in enumerate(zip(self.slot_bins, fills)):
+            self.open_bins[b] = slot
+            self.tree.set_fill(slot, fill)
+
+    def add(self, item):
+        '''
+        Pack one item, and return the index of the bin it was placed in.
+        '''
+        slot = self.tree.first_fit(item)
+
+        # Slots we haven't used yet have a fill level of 0, but the item
+        # has to go in a bin we actually open (this also covers items
+        # which are bigger than the bin size)
+        if slot == -1 or slot >= len(self.slot_bins):
+            slot = self.open_bin()
+
+        b = self.slot_bins[slot]
+        fill = self.tree.fill(slot) + item
+        self.tree.set_fill(slot, fill)
+
+        # Close the bin if even the smallest item won't fit in it any more
+        if self.min_item_size is not None and self.min_item_size + fill > self.bin_size:
+            self.close_bin(b)
+
+        self.number_of_items += 1
+        return b
+
+    def extend(self, items):
+        '''
+        Pack all the items from any iterable (list, array, generator...),
+        and return the index of the bin each item was placed in, as a list.
+        '''
+        return [self.add(item) for item in items]
+
+    def iter_add(self, items):
+        '''
+        Same as extend(), but lazily: items are only read from the iterable
+        (and packed) as the bin indices are requested.
+        '''
+        for item in items:
+            yield self.add(item)
+
+    def fill_levels(self):
+        '''
+        Return the fill levels of the bins which are still open, as a list.
+        '''
+        return [self.tree.fill(slot) for slot in self.open_bins.values()]
+
+
+def pack_many(item_sets, bin_sizes, method='decreasing', algorithm='first_fit'):
+    '''
+    Pack each row of item_sets with the chosen algorithm
+    ('first_fit', 'best_fit', 'worst_fit', or 'next_fit').
+    Input and output are the same as first_fit_many().
+    '''
+    if algorithm == 'first_fit':
+        return first_fit_many(item_sets, bin_sizes, method)
+
+    algorithms = {'best_fit': best_fit, 'worst_fit': worst_fit, 'next_fit': next_fit}
+    if algorithm not in algorithms:
+        raise ValueError(f'algorithm is {algorithm}, should be "first_fit", "best_fit", "worst_fit", or "next_fit".')
+
+    # One bin per item, plus the first bin (empty if every item is too big)
+    number_of_sets, number_of_items = item_sets.shape
+    bins = np.zeros((number_of_sets, number_of_items + 1))
+    bins_used = np.zeros(number_of_sets, dtype=int)
+
+    for i in range(number_of_sets):
+        bins_i = algorithms[algorithm](item_sets[i, :], bin_sizes[i], method=method)
+        bins_used[i] = len(bins_i)
+        bins[i, :len(bins_i)] = bins_i
+
+    return bins_used, bins
+
+
 def test_first_fit(item_list, bin_size, bins_expected):
     '''
     Convenience function to test that first_fit() is correct
@@ -68,6 +641,167 @@ def test_first_fit(item_list, bin_size, bins_expected):
     print('Test passed.')
 
 
+def test_first_fit_fast(number_of_sets=100, number_of_items=50, max_item_size=10):
+    '''
+    Convenience function to test that first_fit_fast() gives
+    exactly the same bins as first_fit(), for all 3 methods.
+    '''
+    # Include a small example, random item sets, and items which are too big for the bins
+    # (some of them, or all of them, which needs one more bin than there are items)
+    item_sets = [([2, 1, 3, 2, 1, 2, 3, 1], 4), ([], 4), ([5, 1, 6, 2], 4), ([5], 4), ([5, 6], 4), ([5, 6, 7], 4)]
+    for items in max_item_size * np.random.rand(number_of_sets, number_of_items):
+        item_sets.append((list(items), max_item_size))
+
+    for item_list, bin_size in item_sets:
+        for method in ['decreasing', 'increasing', 'none']:
+            bins_expected = first_fit(item_list, bin_size, method=method)
+            bins_result = first_fit_fast(item_list, bin_size, method=method)
+
+            msg = f'Incorrect result with method {method}: expected {bins_expected}, got {bins_result} instead.'
+            assert bins_result == bins_expected, msg
+    print('Test passed.')
+
+
+def test_first_fit_packing(number_of_sets=100, number_of_items=50, max_item_size=10):
+    '''
+    Convenience function to test that the item assignment and counts
+    in the PackingResult from first_fit_packing() agree with its bins.
+    '''
+    for items in max_item_size * np.random.rand(number_of_sets, number_of_items):
+        for method in ['decreasing', 'increasing', 'none']:
+            result = first_fit_packing(items, max_item_size, method=method)
+
+            # Adding up the items assigned to each bin should give its fill level
+            fill = np.bincount(result.assignment, weights=items, minlength=result.bins_used)
+            assert np.allclose(fill, result.fill_levels()), f'Assignment does not match bins with method {method}.'
+            assert result.item_counts().sum() == number_of_items, f'Wrong number of items with method {method}.'
+            assert result.number_of_bins() == len(first_fit(items, max_item_size, method=method))
+    print('Test passed.')
+
+
+def test_first_fit_many(number_of_sets=100, number_of_items=50, max_item_size=10):
+    '''
+    Convenience function to test that first_fit_many() gives
+    exactly the same bins as first_fit() for every row, for all 3 methods.
+    '''
+    item_sets = max_item_size * np.random.rand(number_of_sets, number_of_items)
+    bin_sizes = max_item_size * (0.5 + np.random.rand(number_of_sets))
+
+    # Add a set where every item is bigger than the bin
+    item_sets[-1, :] = max_item_size * (1 + np.random.rand(number_of_items))
+    bin_sizes[-1] = max_item_size
+
+    for method in ['decreasing', 'increasing', 'none']:
+        bins_used, bins = first_fit_many(item_sets, bin_sizes, method=method)
+
+        for i in range(number_of_sets):
+            bins_expected = first_fit(item_sets[i, :], bin_sizes[i], method=method)
+            bins_result = list(bins[i, :bins_used[i]])
+
+            msg = f'Incorrect result for set {i} with method {method}: expected {bins_expected}, got {bins_result} instead.'
+            assert bins_result == bins_expected, msg
+    print('Test passed.')
+
+
+def test_streaming_packer(number_of_sets=100, number_of_items=50, max_item_size=10):
+    '''
+    Convenience function to test that StreamingPacker gives the same bins
+    as first_fit() with method 'none', and that closing bins doesn't
+    change where the items go.
+    '''
+    for items in max_item_size * np.random.rand(number_of_sets, number_of_items):
+        bins_expected = first_fit(items, max_item_size, method='none')
+
+        # Pack all the items at once, or feed them lazily from a generator
+        packer = StreamingPacker(max_item_size)
+        assignment = packer.extend(items)
+        bins_result = packer.fill_levels()
+
+        msg = f'Incorrect result: expected {bins_expected}, got {bins_result} instead.'
+        assert bins_result == bins_expected, msg
+        assert packer.number_of_items == number_of_items
+
+        lazy_packer = StreamingPacker(max_item_size)
+        assert list(lazy_packer.iter_add(item for item in items)) == assignment
+
+        # With room for as many open bins as there are items, none are closed early
+        capped_packer = StreamingPacker(max_item_size, max_open_bins=number_of_items)
+        assert capped_packer.extend(items) == assignment
+
+        # All items are at least as big as the smallest one: closing bins
+        # which can't take it shouldn't change the assignment
+        closing_packer = StreamingPacker(max_item_size, min_item_size=min(items))
+        closing_assignment = [closing_packer.add(item) for item in items]
+        msg = f'Closing bins changed the assignment: {assignment} vs. {closing_assignment}.'
+        assert closing_assignment == assignment, msg
+
+    # Items which never fill the bins enough to close them: only max_open_bins keeps them in check
+    packer = StreamingPacker(1.0, min_item_size=0.1, max_open_bins=100)
+    packer.extend([0.6] * 5000)
+    assert len(packer.open_bins) <= 100 and packer.closed_bins == packer.number_of_bins - len(packer.open_bins)
+    assert packer.tree.size <= 256
+    print('Test passed.')
+
+
+def test_fit_heuristics(number_of_sets=100, number_of_items=50, max_item_size=10):
+    '''
+    Convenience function to test best_fit(), worst_fit() and next_fit()
+    against simple versions which check every open bin in turn.
+    '''
+    def best_fit_slow(items, bin_size):
+        bins = [0]
+        for item in items:
+            fits = [b for b in range(len(bins)) if item + bins[b] <= bin_size]
+            if fits:
+                b = max(fits, key=lambda b: (bins[b], -b))
+                bins[b] += item
+            else:
+                bins.append(item)
+        return bins
+
+    def worst_fit_slow(items, bin_size):
+        bins = [0]
+        for item in items:
+            b = min(range(len(bins)), key=lambda b: (bins[b], b))
+            if item + bins[b] <= bin_size:
+                bins[b] += item
+            else:
+                bins.append(item)
+        return bins
+
+    def next_fit_slow(items, bin_size):
+        bins = [0]
+        for item in items:
+            if item + bins[-1] <= bin_size:
+                bins[-1] += item
+            else:
+                bins.append(item)
+        return bins
+
+    checks = [(best_fit, best_fit_slow), (worst_fit, worst_fit_slow), (next_fit, next_fit_slow)]
+
+    # Include items which are too big for the bins, and lots of ties
+    item_sets = [([2, 1, 3, 2, 1, 2, 3, 1], 4), ([5, 1, 6, 2, 2, 2], 4)]
+    for items in max_item_size * np.random.rand(number_of_sets, number_of_items):
+        item_sets.append((list(items), max_item_size))
+
+    for item_list, bin_size in item_sets:
+        for method in ['decreasing', 'increasing', 'none']:
+            for fast, slow in checks:
+                bins_expected = slow(sort_items(item_list, method), bin_size)
+                bins_result = fast(item_list, bin_size, method=method)
+
+                msg = f'Incorrect result for {fast.__name__} with method {method}: expected {bins_expected}, got {bins_result} instead.'
+                assert bins_result == bins_expected, msg
+
+    # pack_many() with every item too big for the bins
+    for algorithm in ['best_fit', 'worst_fit', 'next_fit']:
+        bins_used, bins = pack_many(np.array([[5., 6.]]), np.array([4.]), algorithm=algorithm)
+        assert bins_used[0] == 3 and list(bins[0]) == [0, 6, 5], f'Incorrect result for pack_many() with {algorithm}.'
+    print('Test passed.')
+
+
+@profiling.profile
 def generate_test_data(number_of_sets=1000, number_of_items=50, max_item_size=10):
     '''
     Convenience function to generate some test data
@@ -82,15 +816,56 @@ def generate_test_data(number_of_sets=1000, number_of_items=50, max_item_size=10
     return item_sets, bin_sizes
 
 
-# Note: you could also break this down further, e.g. have this function return
-# the efficiency array, then have another function to calculate some summary statistics,
-# and another function to just plot the results...
-def compare_efficiency(item_sets, bin_sizes, metric='number_of_bins'):
+@profiling.profile
+def generate_test_chunk(seed, number_of_sets, number_of_items=50, max_item_size=10):
     '''
-    Compare packing efficiency of our 3 different methods, using
-    the provided item sets and bin sizes.
+    Generate one chunk of test data, like generate_test_data(),
+    but using its own random number generator started from seed
+    (an integer or a np.random.SeedSequence).
+    '''
+    rng = np.random.default_rng(seed)
+    item_sets = max_item_size * rng.random((number_of_sets, number_of_items))
+    bin_sizes = max_item_size * np.ones(number_of_sets)
 
-    Choose metric between number of bins and % empty space.
+    return item_sets, bin_sizes
+
+
+def chunk_seeds(seed, number_of_sets, chunk_size=1000):
+    '''
+    Split number_of_sets into chunks of (at most) chunk_size sets,
+    and give each chunk its own independent seed derived from seed.
+    Returns a list of (chunk seed, number of sets in the chunk).
+    '''
+    chunk_lengths = [min(chunk_size, number_of_sets - start) for start in range(0, number_of_sets, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_lengths))
+
+    return list(zip(seeds, chunk_lengths))
+
+
+def generate_test_data_seeded(number_of_sets=1000, number_of_items=50, max_item_size=10, seed=0, chunk_size=1000):
+    '''
+    Reproducible version of generate_test_data(): the same seed and chunk_size
+    always give the same item sets. Each chunk of chunk_size sets is generated
+    separately, so that calculate_efficiency_seeded() can generate the exact same
+    data in its worker processes.
+    '''
+    chunks = [generate_test_chunk(s, n, number_of_items, max_item_size)
+              for s, n in chunk_seeds(seed, number_of_sets, chunk_size)]
+    item_sets = np.concatenate([c[0] for c in chunks])
+    bin_sizes = np.concatenate([c[1] for c in chunks])
+
+    return item_sets, bin_sizes
+
+
+@profiling.profile
+def calculate_efficiency(item_sets, bin_sizes, metric='number_of_bins', algorithm='first_fit'):
+    '''
+    Calculate the packing efficiency of our 3 different methods
+    for each of the provided item sets and bin sizes.
+
+    Choose metric between number of bins and % empty space,
+    and algorithm between 'first_fit', 'best_fit', 'worst_fit', and 'next_fit'.
+    Returns an array with one row per item set, and one column per method.
     '''
     # Exercise: add robustness checks here to make sure
     # that we have as many bin_sizes as we have item sets.
@@ -98,54 +873,241 @@ def compare_efficiency(item_sets, bin_sizes, metric='number_of_bins'):
     # Set up empty arrays to store our results
     number_of_sets = item_sets.shape[0]
     efficiency = np.zeros((number_of_sets, 3))
-    percentage_empty_space = np.zeros((number_of_sets, 3))
 
     # Set up to loop over methods
     methods = ['decreasing', 'increasing', 'none']
-    fig, ax = plt.subplots(figsize=(12, 8))
 
     # Use enumerate() to get the method name and the index together
     for j, m in enumerate(methods):
 
-        for i in range(number_of_sets):
-            # Pack current item set with current method
-            bins = first_fit(item_sets[i, :], bin_sizes[i], method=m)
-            if any([b > bin_sizes[i] for b in bins]):
-                print(bins, bin_sizes[i], m)
-
-            if metric == 'number_of_bins':
-                # Count number of bins used
-                efficiency[i, j] = len(bins)
-
-            elif metric == 'empty_space':
-                # Calculate the % of empty space across all bins
-                # (this is more useful if the bin size is randomised, as it's normalised)
-                total_bin_space = bin_sizes[i] * len(bins)
-                efficiency[i, j] = 100 * (total_bin_space - sum(bins)) / total_bin_space
-            
-            else:
-                raise ValueError(f'metric should be "number_of_bins" or "empty_space", not {metric}.')
-        
+        # Pack all item sets with current method
+        bins_used, bins = pack_many(item_sets, bin_sizes, method=m, algorithm=algorithm)
+        overfull = (bins > bin_sizes[:, np.newaxis]).any(axis=1)
+        for i in np.flatnonzero(overfull):
+            print(bins[i, :bins_used[i]], bin_sizes[i], m)
+
+        efficiency[:, j] = packing_metric(bins_used, bins.sum(axis=1), bin_sizes, metric)
+
+    return efficiency
+
+
+def calculate_efficiency_parallel(item_sets, bin_sizes, metric='number_of_bins', algorithm='first_fit',
+                                  workers=None, chunk_size=1000):
+    '''
+    Same as calculate_efficiency(), but splits the item sets into chunks
+    of chunk_size sets and packs them in a pool of worker processes
+    (workers=None uses one process per CPU).
+    The result is the same whatever the number of workers.
+    '''
+    number_of_sets = item_sets.shape[0]
+    if bin_sizes.shape[0] != number_of_sets:
+        raise ValueError(f'Got {number_of_sets} item sets but {bin_sizes.shape[0]} bin sizes.')
+
+    starts = range(0, number_of_sets, chunk_size)
+    item_chunks = [item_sets[i:i + chunk_size] for i in starts]
+    bin_chunks = [bin_sizes[i:i + chunk_size] for i in starts]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(calculate_efficiency, item_chunks, bin_chunks, repeat(metric), repeat(algorithm))
+        efficiency = np.concatenate(list(results))
+
+    return efficiency
+
+
+def generate_and_calculate_efficiency(seed, number_of_sets, number_of_items, max_item_size, metric, algorithm):
+    '''
+    Generate one chunk of test data and calculate its packing efficiency
+    (this is what each worker of calculate_efficiency_seeded() runs).
+    '''
+    item_sets, bin_sizes = generate_test_chunk(seed, number_of_sets, number_of_items, max_item_size)
+    return calculate_efficiency(item_sets, bin_sizes, metric, algorithm)
+
+
+def calculate_efficiency_seeded(number_of_sets=1000, number_of_items=50, max_item_size=10, seed=0,
+                                metric='number_of_bins', algorithm='first_fit', workers=None, chunk_size=1000,
+                                first_set=0):
+    '''
+    Calculate the packing efficiency for the data from generate_test_data_seeded(),
+    without ever building the full item_sets array: each worker process
+    generates its own chunks of data from their seeds, and only sends back
+    the efficiency. The result is the same whatever the number of workers
+    (workers=1 runs everything in this process, without a pool).
+
+    Use first_set to skip the item sets we already have results for:
+    only rows first_set to number_of_sets are returned.
+    '''
+    # Start from the chunk containing first_set (its first few rows are dropped at the end)
+    first_chunk = first_set // chunk_size
+    seeds, chunk_lengths = zip(*chunk_seeds(seed, number_of_sets, chunk_size)[first_chunk:])
+    arguments = (seeds, chunk_lengths, repeat(number_of_items), repeat(max_item_size), repeat(metric), repeat(algorithm))
+
+    if workers == 1:
+        results = map(generate_and_calculate_efficiency, *arguments)
+        efficiency = np.concatenate(list(results))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(generate_and_calculate_efficiency, *arguments)
+            efficiency = np.concatenate(list(results))
+
+    return efficiency[first_set - first_chunk * chunk_size:]
+
+
+def cache_path(cache_dir, **parameters):
+    '''
+    File name in the cache for a set of experiment parameters.
+    '''
+    key = json.dumps(parameters, sort_keys=True)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz'), key
+
+
+def evict_cache(cache_dir, max_cache_size):
+    '''
+    Delete the least recently used cache files (oldest modification time)
+    until the cache takes up at most max_cache_size bytes.
+    '''
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith('.npz')]
+    files.sort(key=os.path.getmtime)
+    total_size = sum(os.path.getsize(f) for f in files)
+
+    for f in files:
+        if total_size <= max_cache_size:
+            break
+        total_size -= os.path.getsize(f)
+        os.remove(f)
 
+
+@profiling.profile
+def cached_efficiency(number_of_sets=1000, number_of_items=50, max_item_size=10, seed=0,
+                      metric='number_of_bins', algorithm='first_fit', workers=1, chunk_size=1000,
+                      cache_dir='bin_packing_cache', max_cache_size=100_000_000):
+    '''
+    Same as calculate_efficiency_seeded(), but saves the results on disk
+    (as compressed .npz files in cache_dir), so running the same experiment
+    again just loads them.
+
+    The item sets for a given seed and chunk_size are always the same,
+    and asking for more sets only adds new rows at the end, so the cache
+    is shared between different values of number_of_sets: if we already
+    have some of the rows, only the new ones are packed.
+
+    The cache is kept under max_cache_size bytes by deleting
+    the least recently used results.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    filename, key = cache_path(cache_dir, number_of_items=number_of_items, max_item_size=max_item_size,
+                               seed=seed, chunk_size=chunk_size, metric=metric, algorithm=algorithm)
+
+    # Load what we already have
+    efficiency = np.zeros((0, 3))
+    if os.path.exists(filename):
+        with np.load(filename) as cached:
+            if str(cached['key']) == key:
+                efficiency = cached['efficiency']
+
+    # Only pack the item sets we don't have yet
+    if efficiency.shape[0] < number_of_sets:
+        new_efficiency = calculate_efficiency_seeded(number_of_sets, number_of_items, max_item_size, seed,
+                                                     metric, algorithm, workers, chunk_size,
+                                                     first_set=efficiency.shape[0])
+        efficiency = np.concatenate([efficiency, new_efficiency])
+
+        # Save to a temporary file first, so we never leave a half-written file in the cache
+        # (np.savez_compressed() adds .npz to the name)
+        np.savez_compressed(filename + '.tmp', efficiency=efficiency, key=key)
+        os.replace(filename + '.tmp.npz', filename)
+    else:
+        # Mark as recently used
+        os.utime(filename)
+
+    evict_cache(cache_dir, max_cache_size)
+
+    return efficiency[:number_of_sets]
+
+
+@profiling.profile
+def plot_efficiency(efficiency, metric='number_of_bins', algorithm='first_fit'):
+    '''
+    Plot histograms of the packing efficiency
+    (as returned by calculate_efficiency()) for each method.
+    '''
+    import matplotlib.pyplot as plt
+
+    # Setting the font size for all plots
+    # https://matplotlib.org/stable/users/explain/customizing.html#runtime-rc-settings
+    import matplotlib as mpl
+    mpl.rcParams['font.size'] = 18
+
+    methods = ['decreasing', 'increasing', 'none']
+    fig, ax = plt.subplots(figsize=(12, 8))
+
+    for j, m in enumerate(methods):
         # Visualise results for the current method
         ax.hist(efficiency[:, j], alpha=0.5, label=m)
 
-    ax.set(xlabel=metric, ylabel='Frequency', title='Comparing different sorting methods for first fit')
+    ax.set(xlabel=metric, ylabel='Frequency', title=f'Comparing different sorting methods for {algorithm.replace("_", " ")}')
     ax.legend()
 
     plt.show()
 
 
+def compare_efficiency(item_sets, bin_sizes, metric='number_of_bins', algorithm='first_fit', workers=1, chunk_size=1000):
+    '''
+    Compare packing efficiency of our 3 different methods, using
+    the provided item sets and bin sizes.
+
+    Choose metric between number of bins and % empty space,
+    and algorithm between 'first_fit', 'best_fit', 'worst_fit', and 'next_fit'.
+    Use workers > 1 (or None for all CPUs) to pack the item sets
+    in parallel, in chunks of chunk_size sets.
+
+    Returns the efficiency array (one row per item set, one column per method);
+    use plot_efficiency() to visualise it.
+    '''
+    if workers == 1:
+        efficiency = calculate_efficiency(item_sets, bin_sizes, metric, algorithm)
+    else:
+        efficiency = calculate_efficiency_parallel(item_sets, bin_sizes, metric, algorithm, workers, chunk_size)
+
+    return efficiency
+
+
 if __name__ == "__main__":
+    # Run with --profile report.json to see how long each stage takes
+    # (see profiling.py)
+    profiling.from_command_line()
+
     # Testing the function
     # test_first_fit([2, 1, 3, 2, 1, 2, 3, 1], 4, [4, 4, 4, 3])
+    # test_first_fit_fast()
+    # test_first_fit_packing()
+    # test_first_fit_many()
+    # test_streaming_packer()
+    # test_fit_heuristics()
 
     # Comparing efficiency of 3 methods.
     # Setting up the test data
     number_of_sets = 5000
     number_of_items = 50
     max_item_size = 10
-    item_sets, bin_sizes = generate_test_data(number_of_sets, number_of_items, max_item_size)
 
-    # Calculating and displaying efficiency
-    compare_efficiency(item_sets, bin_sizes, metric='empty_space')
\ No newline at end of file
+    # Calculating and displaying efficiency, with reproducible test data.
+    # Results are saved in bin_packing_cache/, so running this again
+    # (or with more sets) doesn't repeat the packing we've already done.
+    efficiency = cached_efficiency(number_of_sets, number_of_items, max_item_size, seed=42, metric='empty_space')
+    plot_efficiency(efficiency, metric='empty_space')
+
+    # Or with new random test data each time
+    # item_sets, bin_sizes = generate_test_data(number_of_sets, number_of_items, max_item_size)
+    # efficiency = compare_efficiency(item_sets, bin_sizes, metric='empty_space')
+    # plot_efficiency(efficiency, metric='empty_space')
+
+    # Try the other algorithms too
+    # for algorithm in ['best_fit', 'worst_fit', 'next_fit']:
+    #     efficiency = cached_efficiency(number_of_sets, number_of_items, max_item_size, seed=42,
+    #                                    metric='empty_space', algorithm=algorithm)
+    #     plot_efficiency(efficiency, metric='empty_space', algorithm=algorithm)
+
+    # Same thing, in parallel over all CPUs, with reproducible test data
+    # efficiency = calculate_efficiency_seeded(number_of_sets, number_of_items, max_item_size,
+    #                                          seed=42, metric='empty_space', workers=None)
+    # plot_efficiency(efficiency, metric='empty_space')
\ No newline at end of file
@@ -1,8 +1,32 @@
+import contextlib
+import csv
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import sys
+import time
 import numpy as np
 import pandas as pd
-from wordcloud import WordCloud
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from types import SimpleNamespace
+from wordcloud import WordCloud, STOPWORDS
 import matplotlib.pyplot as plt
 
+# profiling.py is shared by all the weeks, in the folder above this one.
+# Without it (e.g. if this folder is copied on its own), nothing is measured.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import profiling
+except ImportError:
+    profiling = SimpleNamespace(profile=lambda function: function,
+                                stage=lambda name: contextlib.nullcontext(),
+                                from_command_line=lambda argv=None: None)
+
 # Code adapted from wordcloud package examples.
 # https://github.com/amueller/word_cloud/tree/main
 # https://amueller.github.io/word_cloud/auto_examples/simple.html#sphx-glr-auto-examples-simple-py
@@ -13,154 +37,423 @@ import matplotlib.pyplot as plt
 # Use dictionaries/tuples
 # Learn how to use a new library!
 
-def save_as_tab_separated(filename, output_suffix='_tabs'):
+def decode_html_entities(data):
+    '''
+    Replace all HTML entities (e.g. &#039; or &amp;) in the text columns
+    of a dataframe with the characters they stand for.
+    All the text cells are processed together, in one vectorised pass.
+    '''
+    text_columns = data.select_dtypes(include='object').columns
+    if len(text_columns) == 0:
+        return data
+
+    # Put all the text cells in one long Series, decode the ones
+    # which contain an "&" (the others can't have any entities), and put them back
+    cells = pd.Series(data[text_columns].to_numpy().ravel())
+    has_entities = cells.str.contains('&', regex=False, na=False)
+    cells[has_entities] = cells[has_entities].map(html.unescape)
+    data[text_columns] = cells.to_numpy().reshape(len(data), len(text_columns))
+
+    return data
+
+
+@profiling.profile
+def save_as_tab_separated(filename, output_suffix='_tabs', chunk_size=100000):
     '''
     Convert comma-separated CSV file to tab-separated
     (for ease of reading/processing as text).
+
+    The file is converted chunk_size rows at a time, so even very large
+    files never need to fit in memory.
     '''
-    # Read the raw datafile
-    data = pd.read_csv(filename, encoding='utf-8')
-    
-    # Remove "response number" column
-    data.drop(columns=['Response number'], inplace=True)
+    output_filename = filename.split('.')[0] + output_suffix + '.csv'
+    start_time = time.perf_counter()
+    number_of_rows = 0
 
-    # Replace mis-encoded apostrophes
-    for col in data.columns:
-        data[col] = data[col].str.replace('&#039;', "'")
+    # Read the raw datafile in chunks, skipping the "response number" column
+    chunks = pd.read_csv(filename, encoding='utf-8', chunksize=chunk_size, dtype=str,
+                         usecols=lambda column: column != 'Response number')
 
-    # Save as tab-separated CSV
-    data.to_csv(filename.split('.')[0] + output_suffix + '.csv', sep='\t', index=False, encoding='utf-8')
+    for i, data in enumerate(chunks):
 
+        # Replace mis-encoded apostrophes (and any other HTML entities)
+        data = decode_html_entities(data)
 
-def scramble_words(filename, output_suffix='_scrambled'):
+        # Save as tab-separated CSV, adding each chunk to the end of the file
+        data.to_csv(output_filename, sep='\t', index=False, encoding='utf-8',
+                    mode='w' if i == 0 else 'a', header=(i == 0))
+        number_of_rows += len(data)
+
+    elapsed = time.perf_counter() - start_time
+    print(f'Converted {number_of_rows} rows in {elapsed:.2f} s ({number_of_rows / max(elapsed, 1e-9):.0f} rows/sec).')
+
+
+@profiling.profile
+def scramble_words(filename, output_suffix='_scrambled', block_size=10000, words_per_answer=10, seed=None):
     '''
     Scramble words in mid-semester feedback responses
     to anonymise them.
+
+    The file is read one row at a time, in blocks of block_size responses:
+    the words of each question are shuffled across all the responses in a block,
+    then split into new "answers" and written straight to the output file.
+    This way the time taken grows linearly with the number of responses,
+    and we never need more than two blocks in memory.
+    If the last block is shorter than block_size, it is scrambled together
+    with the block before it: otherwise, with e.g. just one response in it,
+    that response's words would come out together, only in a different order.
+    Works with any number of questions (columns).
+    '''
+    if block_size < 2:
+        raise ValueError(f'block_size should be at least 2 to mix different responses, not {block_size}.')
+
+    rng = np.random.default_rng(seed)
+    output_filename = filename.split('.')[0] + output_suffix + '.csv'
+
+    with open(filename, 'r', encoding='utf-8', newline='') as f_in, \
+         open(output_filename, 'w', encoding='utf-8', newline='') as f_out:
+
+        reader = csv.reader(f_in, delimiter='\t')
+        writer = csv.writer(f_out, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator='\n')
+
+        # Extract the two words inside the brackets at the start of each header,
+        # and make this the new column headers
+        headers = next(reader)
+        writer.writerow([header.split(')')[0].strip('(') for header in headers])
+        number_of_questions = len(headers)
+
+        # Words for each question, for the responses in the current block
+        by_question = [[] for q in range(number_of_questions)]
+        rows_in_block = 0
+
+        # The last full block is only written once the next one is full too,
+        # so that a short block at the end of the file can be added to it
+        full_block = None
+
+        for answers in reader:
+            # Split each answer into words (removing quotation marks)
+            for q, answer in enumerate(answers[:number_of_questions]):
+                by_question[q] += answer.replace('"', '').split()
+
+            rows_in_block += 1
+            if rows_in_block == block_size:
+                if full_block is not None:
+                    write_scrambled_block(writer, full_block, words_per_answer, rng)
+                full_block = by_question
+                by_question = [[] for q in range(number_of_questions)]
+                rows_in_block = 0
+
+        if full_block is not None:
+            for q in range(number_of_questions):
+                full_block[q] += by_question[q]
+            write_scrambled_block(writer, full_block, words_per_answer, rng)
+        elif rows_in_block > 0:
+            write_scrambled_block(writer, by_question, words_per_answer, rng)
+
+
+def write_scrambled_block(writer, by_question, words_per_answer, rng):
+    '''
+    Shuffle the words for each question, then split them into new
+    "answers" which are words_per_answer long (for the question with
+    the fewest words), and write them as new rows with a csv writer.
+    '''
+    # Number of new responses
+    N_responses = max(1, min([len(q) for q in by_question]) // words_per_answer)
+
+    all_new_answers = []
+    for q in by_question:
+        # Use a random permutation to scramble all the words
+        words = np.array(q, dtype=object)[rng.permutation(len(q))]
+
+        # Group the words in single answers with the same number of words
+        words_per_response = len(words) // N_responses
+        all_new_answers.append([' '.join(words[words_per_response*r:words_per_response*(r + 1)])
+                                for r in range(N_responses)])
+
+    # One row per new response, one column per question
+    writer.writerows(zip(*all_new_answers))
+
+
+# A word: letters in any language (\w, like WordCloud uses), digits, and apostrophes,
+# so that e.g. "café" and "don't" are one word each
+WORD_PATTERN = r"\w[\w']*"
+
+
+def tokenise(text, stopwords):
     '''
-    # Read the data file (in tab-separated form)
-    with open(filename, 'r', encoding='utf-8') as f:
-        responses = f.readlines()
+    Split text into lowercase words, without punctuation
+    or quotation marks, and leave out the stopwords.
+    '''
+    words = [w.strip("'") for w in re.findall(WORD_PATTERN, text.lower())]
+    return [w for w in words if w and w not in stopwords]
+
 
-    # Organise the answers by question
-    by_question = []
+def count_words(filename, stopwords=None):
+    '''
+    Count how many times each word is used in the answers to each question,
+    reading the tab-separated file one row at a time.
+    Returns a dictionary {question: Counter of words}, with the questions
+    taken from the file header.
+    '''
+    if stopwords is None:
+        stopwords = STOPWORDS
 
-    for question in range(6):
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        questions = [header for header in next(reader) if header]
+        counts = {q: Counter() for q in questions}
 
-        all_answers = []
-        
-        # Loop over each student (each row, skip the header)
-        for student in responses[1:]:
+        for answers in reader:
+            for q, answer in zip(questions, answers):
+                counts[q].update(tokenise(answer, stopwords))
 
-            # Separate the 6 answers
-            answers = student.split(sep='\t')
+    return counts
 
-            # Remove quotation marks and newlines
-            words = ''.join([char for char in answers[question] if char not in ['"', '\n']]).split(' ')
 
-            # Concatenate current answer with other answers for the same question
-            all_answers += words
+@profiling.profile
+def load_word_counts(filename, stopwords=None, cache_suffix='_word_counts'):
+    '''
+    Same as count_words(), but saves the word counts in a JSON file next to
+    the data file, and loads them from there next time (unless the data file,
+    the stopwords or WORD_PATTERN have changed), so we don't have to process
+    all the text again just to change how the word clouds look.
+    '''
+    if stopwords is None:
+        stopwords = STOPWORDS
 
-        # Create a list of numbers from 0 to the total number of words collected
-        scrambler = list(range(len(all_answers)))
-        # Shuffle it randomly
-        np.random.shuffle(scrambler)
+    cache_filename = filename.split('.')[0] + cache_suffix + '.json'
+    file_info = os.stat(filename)
+    source = {'size': file_info.st_size, 'mtime': file_info.st_mtime, 'stopwords': sorted(stopwords),
+              'word_pattern': WORD_PATTERN}
 
-        # Use the shuffled list to scramble all the words
-        all_answers = list(np.array(all_answers)[scrambler])
-        by_question.append(all_answers)
+    if os.path.exists(cache_filename):
+        with open(cache_filename, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['source'] == source:
+            return {q: Counter(c) for q, c in cached['counts'].items()}
 
-    # Split the scrambled answers into new "answers" which are 10 words long
-    # (for the question with the fewest combined words)
-    N_responses = min([len(q) for q in by_question]) // 10
-    all_new_answers = []
+    counts = count_words(filename, stopwords)
+    with open(cache_filename, 'w', encoding='utf-8') as f:
+        json.dump({'source': source, 'counts': counts}, f)
 
-    for q in by_question:
+    return counts
 
-        # Calculate the number of words per response for the current question
-        new_answers = []
-        words_per_response = len(q) // N_responses
-
-        # Group the words in single answers with length words_per_response
-        for word_index in range(N_responses):
-            new_answers.append(q[words_per_response*word_index:words_per_response*(word_index + 1)])
-
-        # Add the final (shorter) answer
-        new_answers.append(q[words_per_response*word_index:])
-        all_new_answers.append(new_answers)
-
-    # Finally, rebuild the text for the CSV file, starting with the headers.
-    new_text = ''
-
-    # Extract the two words inside the brackets at the start of each header,
-    # put it between quotes, and make this the new column headers
-    all_headers = []
-    for header in responses[0].split('\t'):
-        all_headers.append('"' + header.split(')')[0].strip('(') + '"')
-    new_text += '\t'.join(all_headers) + '\n'
-
-    # Build each response to each question by using random words from the overall list
-    for r_index in range(N_responses):
-
-        new_text_answer = ''
-        for q_index in range(6):
-            new_text_answer += '"' + ' '.join(all_new_answers[q_index][r_index]) + '"\t'
-
-        new_text += new_text_answer + '\n'
-
-    with open(filename.split('.')[0] + output_suffix + '.csv', 'w', encoding='utf-8') as f:
-        f.write(new_text)
-
-
-def make_word_cloud(filename):
-    # Read the whole text.
-    # text = open(filename).read()
-    with open(filename, 'r') as f:
-        text = f.read()
-    
-    students = text.split('\n')
-    # print(students[2])
-    # print(students)
-
-    # lec_pos = ''
-    # lec_neg = ''
-    all_questions = {'Lecture positives': '',
-                     'Lecture negatives': '',
-                     'Materials positives': '',
-                     'Materials negatives': '',
-                     'Workshops positives': '',
-                     'Workshops negatives': ''}
-
-    for s in students[:-1]:
-        answers = s.strip('\t\n ').split('\t')
-        # print(len(answers))
-        # print(answers)
-        
-        for i, q in enumerate(all_questions.keys()):
-            all_questions[q] += answers[i]
-        
-    # print(all_questions)
-
-
-    for i, q in enumerate(all_questions.keys()):
-
-        # Generate a word cloud image
-        wordcloud = WordCloud().generate(all_questions[q])
-
-        # Display the generated image:
-        # the matplotlib way:
-        plt.imshow(wordcloud, interpolation='bilinear')
-        plt.axis("off")
+
+def render_word_cloud(frequencies, options):
+    '''
+    Generate a word cloud image (as an array) from word frequencies.
+    options are passed to WordCloud(), e.g. width, height, background_color.
+    '''
+    return WordCloud(**options).generate_from_frequencies(frequencies).to_array()
+
+
+@profiling.profile
+def make_word_cloud(filename, output=None, separate_files=False, stopwords=None, workers=None, **options):
+    '''
+    Make one word cloud per question, from the word counts in the file.
+    See draw_word_clouds() for the other arguments.
+    '''
+    counts = load_word_counts(filename, stopwords)
+    draw_word_clouds(counts, output, separate_files, workers, **options)
+
+
+@profiling.profile
+def draw_word_clouds(counts, output=None, separate_files=False, workers=None, **options):
+    '''
+    Draw one word cloud per question, from word counts {question: Counter}.
+    The word clouds are rendered in parallel, in a pool of worker processes
+    (workers=None uses one process per CPU).
+
+    If output is None, show them all in one figure, labelled with the questions.
+    Otherwise, save that figure as output (e.g. 'word_clouds.png'), or,
+    with separate_files=True, save each word cloud in its own PNG file
+    (output is then used as the start of the file names).
+    Any other keyword arguments are passed to WordCloud().
+    '''
+    # Questions nobody answered don't get a word cloud
+    questions = [q for q in counts if counts[q]]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        images = list(executor.map(render_word_cloud, [counts[q] for q in questions], repeat(options)))
+
+    if output is not None and separate_files:
+        for q, image in zip(questions, images):
+            plt.imsave(f'{output}_{q.replace(" ", "_")}.png', image)
+        return
+
+    # Put all the word clouds in the same figure, 2 per row
+    nrows = (len(questions) + 1) // 2
+    fig, axes = plt.subplots(nrows, 2, figsize=(16, 4 * nrows), squeeze=False)
+    for ax in axes.flat:
+        ax.axis('off')
+    for ax, q, image in zip(axes.flat, questions, images):
+        ax.imshow(image, interpolation='bilinear')
+        ax.set_title(q)
+
+    if output is None:
         plt.show()
+    else:
+        fig.savefig(output, bbox_inches='tight')
+        plt.close(fig)
 
     # Future work:
-    # - Label the word clouds, put them in the same figure
-    # - Remove some specific words we're not interested in
-    # - Clean up the quotation marks
-    # - Set up dictionary by reading the first line
+    # - Try different stopwords, colours, shapes...
+
+
+def end_checksum(filename, offset, length=1024):
+    '''
+    Checksum of the last few bytes before offset in a file,
+    to check that the part of the file we've already processed hasn't changed.
+    '''
+    with open(filename, 'rb') as f:
+        f.seek(max(0, offset - length))
+        return hashlib.sha1(f.read(min(length, offset))).hexdigest()
+
+
+def load_feedback_state(state_filename, filename, stopwords):
+    '''
+    Load the checkpoint saved by update_feedback(), if there is one and it
+    still matches the data file (the file hasn't been replaced or shortened,
+    and we're using the same stopwords). Otherwise, return None.
+    '''
+    if not os.path.exists(state_filename):
+        return None
+
+    with open(state_filename, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+
+    if state['stopwords'] != sorted(stopwords) or os.path.getsize(filename) < state['offset']:
+        return None
+
+    # Checkpoint from before responses waited to be scrambled
+    if 'pending_words' not in state:
+        return None
+
+    # Check that the end of the part we've already processed hasn't changed
+    if end_checksum(filename, state['offset']) != state['check']:
+        return None
+
+    state['counts'] = {q: Counter(c) for q, c in state['counts'].items()}
+    return state
+
+
+@profiling.profile
+def update_feedback(filename, stopwords=None, state_suffix='_state', seed=None, min_block_size=10):
+    '''
+    Process only the responses added to the raw feedback file (filename)
+    since the last time this function was run:
+        - convert them to tab-separated and add them to the end of the
+          _tabs.csv file (like save_as_tab_separated()),
+        - scramble their words and add them to the end of the
+          _tabs_scrambled.csv file (like scramble_words()), once there are
+          at least min_block_size responses to scramble together: until then,
+          they wait in the checkpoint, so that one or two new responses
+          are never published on their own,
+        - add their words to the word counts for each question.
+
+    How far we got in the file (as a byte offset) and the word counts
+    are saved in a JSON checkpoint file, so the time taken only depends on
+    the number of new responses. If the file doesn't match the checkpoint
+    any more, everything is processed again from the start.
+
+    Returns the word counts for all the responses so far, {question: Counter},
+    ready for draw_word_clouds().
+    '''
+    if min_block_size < 2:
+        raise ValueError(f'min_block_size should be at least 2 to mix different responses, not {min_block_size}.')
+
+    if stopwords is None:
+        stopwords = STOPWORDS
+
+    base = filename.split('.')[0]
+    tabs_filename = base + '_tabs.csv'
+    scrambled_filename = base + '_tabs_scrambled.csv'
+    state_filename = base + state_suffix + '.json'
+
+    state = load_feedback_state(state_filename, filename, stopwords)
+
+    with open(filename, 'rb') as f:
+        if state is None:
+            # Start from scratch: read the headers first
+            header_line = f.readline().decode('utf-8')
+            headers = next(csv.reader([header_line]))
+            questions = [h.split(')')[0].strip('(') for h in headers if h != 'Response number']
+            state = {'offset': f.tell(),
+                     'headers': headers,
+                     'stopwords': sorted(stopwords),
+                     'rows': 0,
+                     'counts': {q: Counter() for q in questions},
+                     'pending_rows': 0,
+                     'pending_words': [[] for q in questions]}
+
+            # Start new output files, with just the headers
+            pd.DataFrame(columns=[h for h in headers if h != 'Response number']).to_csv(
+                tabs_filename, sep='\t', index=False, encoding='utf-8')
+            with open(scrambled_filename, 'w', encoding='utf-8', newline='') as f_out:
+                csv.writer(f_out, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator='\n').writerow(questions)
+        else:
+            f.seek(state['offset'])
+
+        # Only use complete lines (the last one might still be being written)
+        new_text = f.read()
+        new_text = new_text[:new_text.rfind(b'\n') + 1]
+
+    number_of_new_rows = 0
+    if new_text:
+        # Same steps as save_as_tab_separated()
+        data = pd.read_csv(io.BytesIO(new_text), encoding='utf-8', header=None, names=state['headers'], dtype=str)
+        data = data.drop(columns=['Response number'], errors='ignore')
+        data = decode_html_entities(data)
+        data.to_csv(tabs_filename, sep='\t', index=False, header=False, mode='a', encoding='utf-8')
+
+        # Update the word counts, and add the words to the ones waiting to be scrambled
+        for i, (column, q) in enumerate(zip(data.columns, state['counts'])):
+            answers = data[column].dropna()
+            for answer in answers:
+                state['counts'][q].update(tokenise(answer, stopwords))
+            state['pending_words'][i] += ' '.join(answers).replace('"', '').split()
+
+        number_of_new_rows = len(data)
+        state['rows'] += number_of_new_rows
+        state['pending_rows'] += number_of_new_rows
+
+        # Only scramble once there are enough responses to mix together
+        if state['pending_rows'] >= min_block_size:
+            with open(scrambled_filename, 'a', encoding='utf-8', newline='') as f_out:
+                writer = csv.writer(f_out, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator='\n')
+                write_scrambled_block(writer, state['pending_words'], 10, np.random.default_rng(seed))
+            state['pending_rows'] = 0
+            state['pending_words'] = [[] for q in state['counts']]
+
+    print(f'{number_of_new_rows} new responses, {state["rows"]} in total '
+          f'({state["pending_rows"]} waiting to be scrambled).')
+
+    # Save the checkpoint (to a temporary file first, so it's never half-written)
+    state['offset'] += len(new_text)
+    state['check'] = end_checksum(filename, state['offset'])
+
+    with open(state_filename + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(state_filename + '.tmp', state_filename)
+
+    return state['counts']
+
 
 if __name__ == "__main__":
+    # Run with --profile report.json to see how long each stage takes
+    # (see profiling.py)
+    profiling.from_command_line()
+
     make_word_cloud('Mid-semester feedback_tabs_scrambled.csv')
 
+    # Save the word clouds without showing them, in one figure or one file each
+    # make_word_cloud('Mid-semester feedback_tabs_scrambled.csv', output='word_clouds.png')
+    # make_word_cloud('Mid-semester feedback_tabs_scrambled.csv', output='word_cloud', separate_files=True)
+
     # Pre-processing before the lecture to anonymise the results
     # save_as_tab_separated('Mid-semester feedback.csv')
     # scramble_words('Mid-semester feedback_tabs.csv')
+
+    # Or, as responses come in, only process the new ones each time
+    # counts = update_feedback('Mid-semester feedback.csv')
+    # draw_word_clouds(counts, output='word_clouds.png')
@@ -0,0 +1,107 @@
+import json
+import os
+
+import pandas as pd
+
+# Loading the Pet Cats UK data (see cats_analysis.ipynb) with proper types,
+# instead of re-parsing the CSV text every time.
+#
+# The first time, the CSV file is parsed once into typed columns (categories
+# for repeated strings, datetimes, float32 coordinates, booleans) and saved as
+# a Parquet file next to it. After that, data is loaded straight from the
+# Parquet file, and we can load only the columns we need.
+# The CSV is only parsed again if it changes.
+
+# Column types for the activity log (cats_uk.csv, saved as activity.csv in the notebook)
+ACTIVITY_DTYPES = {'tag_id': 'category',
+                   'event_id': 'int64',
+                   'visible': 'bool',
+                   'location_long': 'float32',
+                   'location_lat': 'float32',
+                   'ground_speed': 'int32',
+                   'height_above_ellipsoid': 'float32',
+                   'algorithm_marked_outlier': 'bool',
+                   'manually_marked_outlier': 'bool',
+                   'study_name': 'category'}
+
+# Column types for the cat information (cats_uk_reference.csv)
+# ('boolean' allows missing values, unlike 'bool')
+CAT_INFO_DTYPES = {'tag_id': 'category',
+                   'animal_id': 'category',
+                   'animal_taxon': 'category',
+                   'hunt': 'boolean',
+                   'prey_p_month': 'float32',
+                   'animal_reproductive_condition': 'category',
+                   'animal_sex': 'category',
+                   'hrs_indoors': 'float32',
+                   'n_cats': 'int8',
+                   'food_dry': 'boolean',
+                   'food_wet': 'boolean',
+                   'food_other': 'boolean',
+                   'study_site': 'category',
+                   'age_years': 'float32'}
+
+
+def source_info(filename):
+    '''
+    Size and modification time of a file, to tell if it has changed.
+    '''
+    file_info = os.stat(filename)
+    return {'size': file_info.st_size, 'mtime': file_info.st_mtime_ns}
+
+
+def load_typed(csv_filename, dtypes, date_columns, columns=None, store_filename=None):
+    '''
+    Load a CSV file with the given column types, through a Parquet store
+    (by default, the same file name with .parquet instead of .csv).
+    Only the columns in the list columns are loaded (all of them if None).
+    '''
+    if store_filename is None:
+        store_filename = os.path.splitext(csv_filename)[0] + '.parquet'
+    info_filename = store_filename + '.json'
+
+    # Is the store up to date with the CSV file?
+    up_to_date = False
+    if os.path.exists(store_filename) and os.path.exists(info_filename):
+        with open(info_filename, 'r') as f:
+            up_to_date = json.load(f) == source_info(csv_filename)
+
+    if not up_to_date:
+        # Parse the CSV file once, with the right types
+        # (the first column is the row number, saved by .to_csv() in the notebook)
+        data = pd.read_csv(csv_filename, index_col=0, dtype=dtypes, parse_dates=date_columns)
+        data.to_parquet(store_filename)
+        with open(info_filename, 'w') as f:
+            json.dump(source_info(csv_filename), f)
+
+        if columns is not None:
+            data = data[columns]
+        return data
+
+    return pd.read_parquet(store_filename, columns=columns)
+
+
+def load_activity(filename='activity.csv', columns=None, store_filename=None):
+    '''
+    Load the cat activity log (GPS fixes), with typed columns:
+    categorical tag_id and study_name, datetime timestamps,
+    float32 coordinates and boolean flags.
+    Use columns to only load some of the columns, e.g. ['tag_id', 'timestamp'].
+    '''
+    return load_typed(filename, ACTIVITY_DTYPES, ['timestamp'], columns, store_filename)
+
+
+def load_cat_info(filename='cats_uk_reference.csv', columns=None, store_filename=None):
+    '''
+    Load the information about each cat, with typed columns
+    (same as load_activity()).
+    '''
+    return load_typed(filename, CAT_INFO_DTYPES, ['deploy_on_date', 'deploy_off_date'], columns, store_filename)
+
+
+if __name__ == '__main__':
+    activity = load_activity()
+    activity.info()
+
+    cat_info = load_cat_info()
+    cat_info.info()
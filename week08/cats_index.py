@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+import cats_data
+
+# Instead of scanning every GPS fix with
+#     activity.loc[activity['tag_id'].isin(some_cats['tag_id'])]
+# each time, sort the fixes by tag_id once: the fixes for each cat are then
+# one contiguous block of rows, and an "offsets" table tells us where each
+# block starts and ends. Selecting some cats (e.g. with a condition on the
+# cat information table) then only touches the rows we want.
+
+
+class ActivityIndex():
+    '''
+    Activity log sorted by tag_id (then timestamp), with the position
+    of each cat's block of rows, linked to the cat information table.
+
+    Input:
+        activity (dataframe): the activity log (e.g. from cats_data.load_activity())
+        cat_info (dataframe): the cat information (e.g. from cats_data.load_cat_info())
+    '''
+
+    def __init__(self, activity, cat_info):
+        tag_ids = activity['tag_id'].astype('category')
+        codes = tag_ids.cat.codes.to_numpy()
+
+        # Sort by cat, then by time (np.lexsort uses the last key first).
+        # Timestamps with a time zone become an array of Timestamp objects with
+        # .to_numpy(), which is very slow to sort: sort their int64 values instead.
+        times = activity['timestamp'].array.asi8
+        order = np.lexsort((times, codes))
+        # (tag_id stays categorical, so each row only stores a small code)
+        self.activity = activity.iloc[order].reset_index(drop=True)
+        self.activity['tag_id'] = tag_ids.iloc[order].reset_index(drop=True)
+
+        # Rows for cat number c are offsets[c] to offsets[c + 1]
+        self.tag_names = list(tag_ids.cat.categories)
+        counts = np.bincount(codes, minlength=len(self.tag_names))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.position = {tag: c for c, tag in enumerate(self.tag_names)}
+
+        self.cat_info = cat_info
+
+    @classmethod
+    def load(cls, activity_filename='activity.csv', cat_info_filename='cats_uk_reference.csv'):
+        '''
+        Build the index from the data files, through the typed stores in cats_data.
+        '''
+        return cls(cats_data.load_activity(activity_filename), cats_data.load_cat_info(cat_info_filename))
+
+    def rows(self, tag_id):
+        '''
+        Slice of rows in self.activity for one cat (empty if the cat has no fixes).
+        '''
+        c = self.position.get(tag_id)
+        if c is None:
+            return slice(0, 0)
+        return slice(self.offsets[c], self.offsets[c + 1])
+
+    def cat(self, tag_id):
+        '''
+        All the fixes for one cat, in time order.
+        '''
+        return self.activity.iloc[self.rows(tag_id)]
+
+    def tags(self, where=None):
+        '''
+        tag_ids of the cats matching a condition on the cat information table.
+        where can be:
+            - a query string, e.g. "animal_sex == 'f' and age_years >= 10"
+            - a function taking the cat information and returning a boolean Series
+            - a boolean Series (e.g. cat_info['hunt'] == True)
+            - None, for all the cats
+        '''
+        if where is None:
+            selected = self.cat_info
+        elif isinstance(where, str):
+            selected = self.cat_info.query(where)
+        elif callable(where):
+            selected = self.cat_info.loc[where(self.cat_info)]
+        else:
+            selected = self.cat_info.loc[where]
+
+        return list(selected['tag_id'].astype(str))
+
+    def cohort(self, where=None):
+        '''
+        All the fixes for the cats matching a condition (see tags()),
+        e.g. the activity data for old female cats:
+            index.cohort("animal_sex == 'f' and age_years >= 10")
+        '''
+        blocks = [self.activity.iloc[self.rows(tag)] for tag in self.tags(where)]
+        if not blocks:
+            return self.activity.iloc[0:0]
+        return pd.concat(blocks)
+
+    def per_cat(self, column, how='mean', where=None):
+        '''
+        Aggregate a numeric column for each cat matching a condition (see tags()),
+        directly over each cat's block of rows.
+        how can be 'count', 'sum', 'mean', 'min', or 'max'.
+        Returns a Series indexed by tag_id.
+        '''
+        tags = self.tags(where)
+        rows = [self.rows(tag) for tag in tags]
+        starts = np.array([r.start for r in rows], dtype=int)
+        stops = np.array([r.stop for r in rows], dtype=int)
+        counts = stops - starts
+
+        values = self.activity[column].to_numpy()
+        result = np.full(len(tags), np.nan)
+
+        # np.ufunc.reduceat() needs at least one row per block:
+        # cats without any fixes keep NaN (or a count of 0)
+        has_rows = counts > 0
+        if how == 'count':
+            result = counts.astype(float)
+        elif has_rows.any():
+            # Start and end of each block, reduceat gives the result for each
+            # [start, end) pair, and for the gaps in between which we skip
+            bounds = np.column_stack([starts[has_rows], stops[has_rows]]).ravel()
+            padded = np.append(values, values[:1])
+
+            if how in ['sum', 'mean']:
+                totals = np.add.reduceat(padded, bounds)[::2]
+                result[has_rows] = totals / counts[has_rows] if how == 'mean' else totals
+            elif how == 'min':
+                result[has_rows] = np.minimum.reduceat(padded, bounds)[::2]
+            elif how == 'max':
+                result[has_rows] = np.maximum.reduceat(padded, bounds)[::2]
+            else:
+                raise ValueError(f'how should be "count", "sum", "mean", "min", or "max", not {how}.')
+
+        return pd.Series(result, index=pd.Index(tags, name='tag_id'), name=f'{column}_{how}')
+
+
+def test_activity_index():
+    '''
+    Convenience function to test ActivityIndex against the
+    boolean indexing and groupby from the notebook.
+    '''
+    activity = pd.read_csv('activity.csv', index_col=0, parse_dates=['timestamp'])
+    cat_info = pd.read_csv('cats_uk_reference.csv', index_col=0)
+    index = ActivityIndex(activity, cat_info)
+    assert index.activity['tag_id'].dtype == 'category', 'tag_id is not categorical.'
+
+    # Same fixes as with .isin()
+    old_f_cats = cat_info.loc[(cat_info['animal_sex'] == 'f') & (cat_info['age_years'] >= 10)]
+    expected = activity.loc[activity['tag_id'].isin(old_f_cats['tag_id'])]
+    result = index.cohort("animal_sex == 'f' and age_years >= 10")
+    assert sorted(result['event_id']) == sorted(expected['event_id']), 'Wrong cohort.'
+    assert result['timestamp'].groupby(result['tag_id'], observed=True).apply(lambda t: t.is_monotonic_increasing).all()
+
+    # Same aggregates as with .groupby()
+    for how in ['count', 'mean', 'min', 'max']:
+        expected = activity.groupby('tag_id')['ground_speed'].agg(how)
+        result = index.per_cat('ground_speed', how, where=lambda c: c['hunt'] == True)
+        assert np.allclose(result, expected.reindex(result.index).fillna(0 if how == 'count' else np.nan),
+                           equal_nan=True), f'Wrong per-cat {how}.'
+
+    print('Test passed.')
+
+
+if __name__ == '__main__':
+    index = ActivityIndex.load()
+
+    # Activity data only for old female cats
+    activity_old_f = index.cohort("animal_sex == 'f' and age_years >= 10")
+    print(activity_old_f)
+
+    # Average ground speed of each cat that hunts
+    print(index.per_cat('ground_speed', 'mean', where=lambda cat_info: cat_info['hunt'] == True))
@@ -0,0 +1,278 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import cats_data
+from cats_trajectories import EARTH_RADIUS, haversine
+
+# A spatial index for the GPS fixes: a uniform grid of cells
+# (cell_size degrees wide and high), with the fixes sorted by cell.
+# Like the offsets in ActivityIndex, we keep where each cell's block of fixes
+# starts, so finding the fixes in an area only looks at the cells around it,
+# not at every fix. Only cells with fixes in them are stored.
+
+# Metres per degree of latitude
+METRES_PER_DEGREE = 2 * np.pi * EARTH_RADIUS / 360
+
+
+class SpatialGrid():
+    '''
+    Grid index over longitude/latitude points.
+
+    Input:
+        lon, lat (arrays): coordinates of the points, in degrees
+        tags (array or None): tag_id of each point, for home ranges
+        cell_size (float): size of the grid cells, in degrees
+    '''
+
+    def __init__(self, lon, lat, tags=None, cell_size=0.001):
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.tags = None if tags is None else np.asarray(tags, dtype=str)
+        self.cell_size = cell_size
+
+        # Cell of each point
+        self.lon0, self.lat0 = self.lon.min(), self.lat.min()
+        self.nx = int((self.lon.max() - self.lon0) // cell_size) + 1
+        self.ny = int((self.lat.max() - self.lat0) // cell_size) + 1
+        cells = self.cell_of(self.lon, self.lat)
+
+        # Sort the points by cell; points in cell_ids[k] are order[starts[k]:starts[k + 1]]
+        self.order = np.argsort(cells, kind='stable')
+        self.cell_ids, first = np.unique(cells[self.order], return_index=True)
+        self.starts = np.append(first, len(cells))
+
+    def cell_xy(self, lon, lat):
+        '''
+        Grid column and row of points (can be outside the grid).
+        '''
+        ix = np.floor((np.asarray(lon) - self.lon0) / self.cell_size).astype(int)
+        iy = np.floor((np.asarray(lat) - self.lat0) / self.cell_size).astype(int)
+        return ix, iy
+
+    def cell_of(self, lon, lat):
+        ix, iy = self.cell_xy(lon, lat)
+        return iy * self.nx + ix
+
+    def rows_in_cells(self, ix0, ix1, iy0, iy1):
+        '''
+        Index of all the points in the cells from columns ix0 to ix1
+        and rows iy0 to iy1 (inclusive). The cells of each grid row
+        are next to each other in the sorted points, so we only need
+        one slice per grid row.
+        '''
+        ix0, ix1 = max(ix0, 0), min(ix1, self.nx - 1)
+        iy0, iy1 = max(iy0, 0), min(iy1, self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.array([], dtype=int)
+
+        first_cells = np.arange(iy0, iy1 + 1) * self.nx + ix0
+        a = np.searchsorted(self.cell_ids, first_cells)
+        b = np.searchsorted(self.cell_ids, first_cells + (ix1 - ix0), side='right')
+        return np.concatenate([self.order[self.starts[i]:self.starts[j]] for i, j in zip(a, b)])
+
+    def bbox(self, lon_min, lat_min, lon_max, lat_max):
+        '''
+        Index of the points inside a bounding box.
+        '''
+        ix0, iy0 = self.cell_xy(lon_min, lat_min)
+        ix1, iy1 = self.cell_xy(lon_max, lat_max)
+        rows = self.rows_in_cells(ix0, ix1, iy0, iy1)
+
+        inside = ((self.lon[rows] >= lon_min) & (self.lon[rows] <= lon_max)
+                  & (self.lat[rows] >= lat_min) & (self.lat[rows] <= lat_max))
+        return np.sort(rows[inside])
+
+    def radius(self, lon, lat, radius):
+        '''
+        Index of the points within radius metres of (lon, lat).
+        '''
+        # Bounding box around the circle, then check the actual distances
+        dlat = radius / METRES_PER_DEGREE
+        dlon = dlat / max(np.cos(np.radians(lat + np.sign(lat) * dlat)), 1e-12)
+        rows = self.bbox(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+
+        return rows[haversine(lon, lat, self.lon[rows], self.lat[rows]) <= radius]
+
+    def nearest(self, lon, lat):
+        '''
+        Index of the point nearest to (lon, lat), and its distance in metres.
+        '''
+        # Look in bigger and bigger squares of cells until we find some points...
+        ix, iy = self.cell_xy(lon, lat)
+        k = 0
+        rows = self.rows_in_cells(ix, ix, iy, iy)
+        while len(rows) == 0:
+            k += 1
+            rows = self.rows_in_cells(ix - k, ix + k, iy - k, iy + k)
+
+        # ...but the nearest one could be in a cell further out than the closest
+        # one we found: check all the points within that distance
+        distances = haversine(lon, lat, self.lon[rows], self.lat[rows])
+        rows = self.radius(lon, lat, distances.min() * (1 + 1e-9) + 1e-6)
+        distances = haversine(lon, lat, self.lon[rows], self.lat[rows])
+
+        return rows[np.argmin(distances)], distances.min()
+
+    def home_ranges(self, method='grid'):
+        '''
+        Home range area (in m²) of each tag, as a Series indexed by tag_id.
+        method can be:
+            'grid': total area of the grid cells the tag visited
+            'hull': area of the convex hull of all the tag's points
+        '''
+        if self.tags is None:
+            raise ValueError('No tags given for the points, cannot calculate home ranges.')
+
+        tag_names, tag_codes = np.unique(self.tags, return_inverse=True)
+
+        if method == 'grid':
+            # Each distinct (tag, cell) pair counts once
+            cells = self.cell_of(self.lon, self.lat)
+            pairs = np.unique(tag_codes.astype(np.int64) * (self.nx * self.ny) + cells)
+            pair_tags = pairs // (self.nx * self.ny)
+            pair_cells = pairs % (self.nx * self.ny)
+
+            # Cells get narrower further north
+            cell_lat = self.lat0 + (pair_cells // self.nx + 0.5) * self.cell_size
+            cell_area = (self.cell_size * METRES_PER_DEGREE)**2 * np.cos(np.radians(cell_lat))
+            areas = np.bincount(pair_tags, weights=cell_area, minlength=len(tag_names))
+
+        elif method == 'hull':
+            areas = np.zeros(len(tag_names))
+            for c in range(len(tag_names)):
+                in_tag = tag_codes == c
+                areas[c] = convex_hull_area(self.lon[in_tag], self.lat[in_tag])
+
+        else:
+            raise ValueError(f'method should be "grid" or "hull", not {method}.')
+
+        return pd.Series(areas, index=pd.Index(tag_names, name='tag_id'), name=f'home_range_{method}')
+
+    def save(self, filename, **extra):
+        '''
+        Save the index to a .npz file (plus any extra arrays).
+        '''
+        arrays = {'lon': self.lon, 'lat': self.lat, 'cell_size': self.cell_size,
+                  'order': self.order, 'cell_ids': self.cell_ids, 'starts': self.starts}
+        if self.tags is not None:
+            arrays['tags'] = self.tags
+        np.savez(filename, **arrays, **extra)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load an index saved with save(), without sorting the points again.
+        '''
+        grid = cls.__new__(cls)
+        with np.load(filename) as saved:
+            grid.lon, grid.lat = saved['lon'], saved['lat']
+            grid.tags = saved['tags'] if 'tags' in saved else None
+            grid.cell_size = float(saved['cell_size'])
+            grid.order, grid.cell_ids, grid.starts = saved['order'], saved['cell_ids'], saved['starts']
+
+        grid.lon0, grid.lat0 = grid.lon.min(), grid.lat.min()
+        grid.nx = int((grid.lon.max() - grid.lon0) // grid.cell_size) + 1
+        grid.ny = int((grid.lat.max() - grid.lat0) // grid.cell_size) + 1
+        return grid
+
+
+def convex_hull_area(lon, lat):
+    '''
+    Area (in m²) of the convex hull of some points, using the
+    monotone chain algorithm on the points projected to metres.
+    '''
+    # Project to metres around the middle of the points
+    x = np.asarray(lon) * METRES_PER_DEGREE * np.cos(np.radians(np.mean(lat)))
+    y = np.asarray(lat) * METRES_PER_DEGREE
+    points = sorted(set(zip(x.tolist(), y.tolist())))
+    if len(points) < 3:
+        return 0.0
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    # Build the lower and upper halves of the hull
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    hull = np.array(lower[:-1] + upper[:-1])
+
+    # Shoelace formula
+    hx, hy = hull[:, 0], hull[:, 1]
+    return 0.5 * abs(np.dot(hx, np.roll(hy, -1)) - np.dot(hy, np.roll(hx, -1)))
+
+
+def load_grid(activity_filename='activity.csv', cell_size=0.001):
+    '''
+    Spatial index for the activity log, saved next to it (e.g. activity_grid.npz)
+    and only built again if the data file or the cell size changes.
+    Point indices are row positions in cats_data.load_activity(activity_filename).
+    '''
+    grid_filename = os.path.splitext(activity_filename)[0] + '_grid.npz'
+    source = cats_data.source_info(activity_filename)
+    source = np.array([source['size'], source['mtime']])
+
+    if os.path.exists(grid_filename):
+        with np.load(grid_filename) as saved:
+            up_to_date = np.array_equal(saved['source'], source) and float(saved['cell_size']) == cell_size
+        if up_to_date:
+            return SpatialGrid.load(grid_filename)
+
+    activity = cats_data.load_activity(activity_filename, columns=['tag_id', 'location_long', 'location_lat'])
+    grid = SpatialGrid(activity['location_long'], activity['location_lat'], activity['tag_id'], cell_size)
+    grid.save(grid_filename, source=source)
+
+    return grid
+
+
+def test_spatial_grid(number_of_queries=50):
+    '''
+    Convenience function to test the grid queries against
+    boolean masks over all the points.
+    '''
+    activity = pd.read_csv('activity.csv', index_col=0)
+    lon, lat = activity['location_long'].to_numpy(), activity['location_lat'].to_numpy()
+    grid = SpatialGrid(lon, lat, activity['tag_id'])
+    rng = np.random.default_rng(0)
+
+    for q in range(number_of_queries):
+        # Query around a random fix
+        i = rng.integers(len(lon))
+        lon_c, lat_c = lon[i] + rng.normal(0, 0.01), lat[i] + rng.normal(0, 0.01)
+        size = rng.uniform(0, 0.02)
+
+        expected = np.flatnonzero((lon >= lon_c - size) & (lon <= lon_c + size) & (lat >= lat_c - size) & (lat <= lat_c + size))
+        assert np.array_equal(grid.bbox(lon_c - size, lat_c - size, lon_c + size, lat_c + size), expected), 'Wrong bbox.'
+
+        distances = haversine(lon_c, lat_c, lon, lat)
+        expected = np.flatnonzero(distances <= 1000 * size * 50)
+        assert np.array_equal(np.sort(grid.radius(lon_c, lat_c, 1000 * size * 50)), expected), 'Wrong radius.'
+
+        nearest, distance = grid.nearest(lon_c, lat_c)
+        assert np.isclose(distance, distances.min()), 'Wrong nearest point.'
+
+    # A square cat, 100 m x 100 m
+    side = 100 / METRES_PER_DEGREE
+    square = SpatialGrid([0, side, 0, side, side / 2], [0, 0, side, side, side / 2], ['Sq'] * 5)
+    assert np.isclose(square.home_ranges('hull')['Sq'], 100 * 100, rtol=1e-3)
+    assert (grid.home_ranges('grid') > 0).all() and (grid.home_ranges('hull') >= 0).all()
+    print('Test passed.')
+
+
+if __name__ == '__main__':
+    grid = load_grid()
+
+    # Fixes within 200 m of the first fix
+    rows = grid.radius(grid.lon[0], grid.lat[0], 200)
+    print(f'{len(rows)} fixes within 200 m.')
+
+    # Home range of each cat
+    print(pd.concat([grid.home_ranges('grid'), grid.home_ranges('hull')], axis=1).describe())
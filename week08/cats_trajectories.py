@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+
+from cats_index import ActivityIndex
+
+# Movement metrics for each cat, calculated from its GPS fixes.
+# Everything works on whole columns at once: the fixes are sorted by cat and
+# time (see ActivityIndex), so each "step" is just the difference between
+# a row and the row before it, except on the first row of each cat.
+
+# Radius of the Earth (m)
+EARTH_RADIUS = 6371000
+
+# Cats can sprint at about 13 m/s (~48 km/h); anything faster than this
+# between two fixes must be a GPS error
+MAX_CAT_SPEED = 14
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    '''
+    Great-circle distance (in m) between points given by their
+    longitude and latitude in degrees (numbers or arrays).
+    '''
+    lon1, lat1, lon2, lat2 = [np.radians(np.asarray(x, dtype=float)) for x in (lon1, lat1, lon2, lat2)]
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def first_rows(offsets, number_of_rows):
+    '''
+    Boolean array, True on the first row of each cat's block of rows.
+    '''
+    first = np.zeros(number_of_rows, dtype=bool)
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]
+    first[starts] = True
+    return first
+
+
+def step_metrics(activity, offsets):
+    '''
+    Distance (m), time (s) and implied speed (m/s) from the previous fix
+    of the same cat, for each fix. activity must be sorted by cat and time,
+    with offsets marking each cat's block of rows (as in ActivityIndex).
+    The first fix of each cat has NaN for all three.
+    '''
+    lon = activity['location_long'].to_numpy(dtype=float)
+    lat = activity['location_lat'].to_numpy(dtype=float)
+    times = activity['timestamp']
+    seconds = (times - times.min()).dt.total_seconds().to_numpy()
+
+    distance = np.full(len(activity), np.nan)
+    step_time = np.full(len(activity), np.nan)
+    distance[1:] = haversine(lon[:-1], lat[:-1], lon[1:], lat[1:])
+    step_time[1:] = np.diff(seconds)
+
+    # Steps from one cat's last fix to the next cat's first fix don't count
+    first = first_rows(offsets, len(activity))
+    distance[first] = np.nan
+    step_time[first] = np.nan
+
+    # Two fixes at the same time: no speed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(step_time > 0, distance / step_time, np.nan)
+
+    return distance, step_time, speed
+
+
+def flag_speed_outliers(speed, offsets, max_speed=MAX_CAT_SPEED):
+    '''
+    Flag fixes which would mean the cat moved impossibly fast.
+    A single wrong fix makes the cat "jump" there and back, so we flag fixes
+    where the speed both to get there and to leave again is above max_speed.
+
+    The first and last fix of each cat only have one step: we flag them if
+    that step is too fast, unless the fix at the other end of the step is
+    already flagged (then the jump is its fault), or is the cat's other end
+    fix (with only 2 fixes, we can't tell which one is wrong).
+    '''
+    first = first_rows(offsets, len(speed))
+    last = np.append(first[1:], True)
+
+    # The step after a cat's last fix belongs to the next cat
+    speed_in = speed
+    speed_out = np.append(speed[1:], np.nan)
+    speed_out[last] = np.nan
+
+    # (comparisons with NaN are False: a missing step is never too fast)
+    too_fast_in = speed_in > max_speed
+    too_fast_out = speed_out > max_speed
+    spikes = too_fast_in & too_fast_out
+
+    # Is the next (previous) fix an ordinary fix in the middle of the track?
+    next_fine = np.append(~spikes[1:] & ~last[1:], False)
+    previous_fine = np.append(False, ~spikes[:-1] & ~first[:-1])
+
+    return spikes | (first & too_fast_out & next_fine) | (last & too_fast_in & previous_fine)
+
+
+def summarise_tracks(index, max_speed=MAX_CAT_SPEED, time_bin='h'):
+    '''
+    Clean and summarise the tracks of all the cats in an ActivityIndex:
+        - flag fixes with an impossible implied speed (see flag_speed_outliers()),
+        - remove them and the fixes already marked as outliers in the data,
+        - calculate the distance and speed between the remaining fixes.
+
+    Returns:
+        tracks (dataframe): the cleaned fixes, with step_distance (m),
+            step_time (s) and implied_speed (m/s) columns
+        summary (dataframe): for each cat, number of fixes, number of outliers
+            removed, total distance (m), total time (h) and average speed (m/s)
+        activity_by_time (dataframe): distance moved by each cat (rows)
+            in each time bin of length time_bin (columns)
+    '''
+    activity = index.activity
+    offsets = index.offsets
+
+    distance, step_time, speed = step_metrics(activity, offsets)
+    outliers = flag_speed_outliers(speed, offsets, max_speed)
+    outliers |= activity['algorithm_marked_outlier'].to_numpy(dtype=bool)
+    outliers |= activity['manually_marked_outlier'].to_numpy(dtype=bool)
+
+    # Remove the outliers, and find where each cat's block starts now
+    keep = ~outliers
+    tracks = activity.loc[keep].reset_index(drop=True)
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    new_offsets = kept_before[offsets]
+
+    # Steps between the remaining fixes
+    distance, step_time, speed = step_metrics(tracks, new_offsets)
+    tracks['step_distance'] = distance
+    tracks['step_time'] = step_time
+    tracks['implied_speed'] = speed
+
+    # Totals for each cat, over each cat's block of rows
+    codes = np.repeat(np.arange(len(index.tag_names)), np.diff(new_offsets))
+    number_of_cats = len(index.tag_names)
+    total_distance = np.bincount(codes, weights=np.nan_to_num(distance), minlength=number_of_cats)
+    total_time = np.bincount(codes, weights=np.nan_to_num(step_time), minlength=number_of_cats)
+
+    summary = pd.DataFrame({'fixes': np.diff(new_offsets),
+                            'outliers_removed': np.diff(offsets) - np.diff(new_offsets),
+                            'total_distance': total_distance,
+                            'total_time': total_time / 3600},
+                           index=pd.Index(index.tag_names, name='tag_id'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['average_speed'] = np.where(total_time > 0, total_distance / total_time, np.nan)
+
+    # Distance moved by each cat in each time bin (each step counts in the bin where it ends)
+    bins = tracks['timestamp'].dt.floor(time_bin)
+    activity_by_time = pd.Series(np.nan_to_num(distance)).groupby([tracks['tag_id'].to_numpy(), bins.to_numpy()]).sum()
+    activity_by_time = activity_by_time.unstack(fill_value=0)
+
+    return tracks, summary, activity_by_time
+
+
+def test_trajectories():
+    '''
+    Convenience function to test the trajectory metrics on a made-up cat
+    walking 100 m north every 10 minutes, with one GPS error, and against
+    a simple groupby/shift version on the real data.
+    '''
+    # 1 degree of latitude is 2 * pi * EARTH_RADIUS / 360 m
+    step = 100 / (2 * np.pi * EARTH_RADIUS / 360)
+    lat = 50 + step * np.arange(10)
+    lat[5] += 1  # GPS error, ~111 km away
+    activity = pd.DataFrame({'tag_id': 'Test-Tag',
+                             'timestamp': pd.date_range('2017-06-24', periods=10, freq='10min'),
+                             'location_long': -5.0,
+                             'location_lat': lat,
+                             'algorithm_marked_outlier': False,
+                             'manually_marked_outlier': False})
+    cat_info = pd.DataFrame({'tag_id': ['Test-Tag']})
+
+    tracks, summary, activity_by_time = summarise_tracks(ActivityIndex(activity, cat_info))
+    assert summary.loc['Test-Tag', 'outliers_removed'] == 1, 'GPS error not flagged.'
+    assert np.isclose(summary.loc['Test-Tag', 'total_distance'], 900), summary
+    assert np.isclose(summary.loc['Test-Tag', 'average_speed'], 100 / 600)
+    assert np.isclose(activity_by_time.to_numpy().sum(), 900)
+
+    # GPS error on the 2nd fix (the 1st one is fine) or on the last fix
+    for wrong, kept in [(1, 0), (9, 8)]:
+        activity['location_lat'] = 50 + step * np.arange(10)
+        activity.loc[wrong, 'location_lat'] += 1
+        tracks, summary, activity_by_time = summarise_tracks(ActivityIndex(activity, cat_info))
+        assert summary.loc['Test-Tag', 'outliers_removed'] == 1, f'Wrong outliers with an error on fix {wrong}.'
+        assert activity.loc[kept, 'timestamp'] in set(tracks['timestamp']), f'Fix {kept} removed.'
+
+    # Real data: same step distances as with groupby and shift
+    index = ActivityIndex(pd.read_csv('activity.csv', index_col=0, parse_dates=['timestamp']),
+                          pd.read_csv('cats_uk_reference.csv', index_col=0))
+    distance, step_time, speed = step_metrics(index.activity, index.offsets)
+    previous = index.activity.groupby('tag_id', observed=True)[['location_long', 'location_lat']].shift()
+    expected = haversine(previous['location_long'], previous['location_lat'],
+                         index.activity['location_long'], index.activity['location_lat'])
+    assert np.allclose(distance, expected, equal_nan=True), 'Wrong step distances.'
+    print('Test passed.')
+
+
+if __name__ == '__main__':
+    index = ActivityIndex.load()
+    tracks, summary, activity_by_time = summarise_tracks(index)
+
+    print(summary.sort_values('total_distance', ascending=False).head(10))
+    print(f'{summary["outliers_removed"].sum()} outliers removed out of {len(index.activity)} fixes.')
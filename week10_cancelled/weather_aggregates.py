@@ -0,0 +1,193 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Daily (or weekly...) summaries and rolling statistics of hourly weather data,
+# calculated a chunk at a time: we only keep running totals for each day,
+# plus the last few hours for the rolling windows, so years of hourly data
+# for lots of cities never need to be in memory at once.
+
+
+class WeatherAggregator():
+    '''
+    Running min/mean/max of weather variables for each city and each period
+    (e.g. each day), plus rolling min/mean/max over a time window,
+    updated with one chunk of hourly data at a time.
+
+    Input:
+        variables (list): names of the columns to aggregate
+        period (str): length of the periods for the summaries,
+            as a pandas period alias ('D' for days, 'W' for weeks, 'M' for months...)
+        window (str): length of the rolling window, e.g. '24h'
+    '''
+
+    def __init__(self, variables=('temperature_2m', 'cloud_cover'), period='D', window='24h'):
+        self.variables = list(variables)
+        self.period = period
+        self.window = pd.Timedelta(window)
+
+        # For each city: a list of dataframes (one per chunk) with one row per period,
+        # and columns (variable, statistic) for count, sum, min and max
+        self.totals = {}
+
+        # For each city: the last few hours of data, to start the next rolling window
+        self.tails = {}
+
+    def update(self, chunk, city=None):
+        '''
+        Add a chunk of hourly data (a dataframe with a time column and the variables,
+        like the ones from get_weather_data()). If the chunk has a city column,
+        it can contain several cities; otherwise, give the city name.
+        The chunks for each city must come in time order.
+
+        Returns the rolling min/mean/max for the times in the chunk.
+        '''
+        if city is None and 'city' in chunk:
+            return pd.concat([self.update(city_chunk, city) for city, city_chunk in chunk.groupby('city', sort=False)])
+
+        data = chunk.set_index(pd.to_datetime(chunk['time']))[self.variables].astype('float64')
+        self.update_totals(data, city)
+        return self.update_rolling(data, city)
+
+    def update_totals(self, data, city):
+        '''
+        Add the data to the running totals for each period.
+        '''
+        periods = data.index.to_period(self.period).start_time
+        new_totals = data.groupby(periods).agg(['count', 'sum', 'min', 'max'])
+        if new_totals.empty:
+            return
+
+        blocks = self.totals.setdefault(city, [])
+        if blocks and blocks[-1].index[-1] == new_totals.index[0]:
+            # The chunks come in time order, so only the last period we had
+            # can carry on in this chunk: combine just that row
+            last = blocks[-1].iloc[-1]
+            first = new_totals.iloc[0].copy()
+            for column in new_totals.columns:
+                if column[1] in ['count', 'sum']:
+                    first[column] += last[column]
+                elif column[1] == 'min':
+                    first[column] = np.fmin(first[column], last[column])
+                else:
+                    first[column] = np.fmax(first[column], last[column])
+
+            new_totals.iloc[0] = first
+            blocks[-1] = blocks[-1].iloc[:-1]
+
+        blocks.append(new_totals)
+
+    def period_totals(self, city):
+        '''
+        Running totals for all the periods so far for one city, as one dataframe.
+        '''
+        return pd.concat(self.totals[city])
+
+    def update_rolling(self, data, city):
+        '''
+        Rolling min/mean/max over the window, continuing from the previous chunk.
+        '''
+        tail = self.tails.get(city)
+        if tail is not None:
+            data = pd.concat([tail, data])
+
+        rolling = data.rolling(self.window).agg(['min', 'mean', 'max'])
+        if tail is not None:
+            rolling = rolling.iloc[len(tail):]
+
+        # Keep the hours we'll need for the start of the next chunk
+        self.tails[city] = data.loc[data.index > data.index[-1] - self.window]
+
+        rolling.columns = [f'{v}_rolling_{statistic}' for v, statistic in rolling.columns]
+        rolling.insert(0, 'city', city)
+        return rolling.rename_axis('time').reset_index()
+
+    def summary(self):
+        '''
+        Min, mean and max of each variable for each city and period, as a dataframe
+        with columns city, time (start of the period), and e.g. temperature_2m_mean.
+        '''
+        summaries = []
+
+        for city in self.totals:
+            totals = self.period_totals(city)
+            summary = pd.DataFrame({'city': city, 'time': totals.index})
+            for v in self.variables:
+                count = totals[(v, 'count')].to_numpy()
+                summary[f'{v}_min'] = totals[(v, 'min')].to_numpy()
+                summary[f'{v}_mean'] = np.where(count > 0, totals[(v, 'sum')].to_numpy() / np.maximum(count, 1), np.nan)
+                summary[f'{v}_max'] = totals[(v, 'max')].to_numpy()
+            summaries.append(summary)
+
+        return pd.concat(summaries, ignore_index=True)
+
+    def save(self, filename):
+        '''
+        Save the aggregator (running totals and rolling window state) to a file,
+        to carry on updating it later.
+        '''
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+def aggregate_csv(filenames, chunk_size=10000, **aggregator_options):
+    '''
+    Aggregate hourly weather CSV files (e.g. {city}_hourly_....csv, as saved by
+    earlier versions of get_weather_data()), reading chunk_size rows at a time.
+    filenames is a dictionary {city name: filename}.
+    Returns the WeatherAggregator; the rolling statistics are not kept.
+    '''
+    aggregator = WeatherAggregator(**aggregator_options)
+
+    for city, filename in filenames.items():
+        for chunk in pd.read_csv(filename, chunksize=chunk_size):
+            aggregator.update(chunk, city)
+
+    return aggregator
+
+
+def test_weather_aggregator(number_of_hours=24 * 100, chunk_size=500):
+    '''
+    Convenience function to test that aggregating chunk by chunk gives
+    the same results as pandas with all the data at once.
+    '''
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2024-01-01', periods=number_of_hours, freq='h')
+    data = pd.DataFrame({'time': times,
+                         'temperature_2m': 10 + 5 * rng.standard_normal(number_of_hours),
+                         'cloud_cover': rng.integers(0, 101, number_of_hours).astype(float)})
+
+    # A few gaps
+    data.loc[rng.integers(0, number_of_hours, 50), 'temperature_2m'] = np.nan
+
+    aggregator = WeatherAggregator()
+    rolling = pd.concat([aggregator.update(data.iloc[i:i + chunk_size], 'Edinburgh')
+                         for i in range(0, number_of_hours, chunk_size)], ignore_index=True)
+    summary = aggregator.summary()
+
+    # Same thing with pandas, all at once
+    hourly = data.set_index('time')
+    daily = hourly.resample('D').agg(['min', 'mean', 'max'])
+    expected_rolling = hourly.rolling('24h').agg(['min', 'mean', 'max'])
+
+    for v in ['temperature_2m', 'cloud_cover']:
+        for statistic in ['min', 'mean', 'max']:
+            msg = f'Wrong daily {statistic} of {v}.'
+            assert np.allclose(summary[f'{v}_{statistic}'], daily[(v, statistic)], equal_nan=True), msg
+
+            msg = f'Wrong rolling {statistic} of {v}.'
+            assert np.allclose(rolling[f'{v}_rolling_{statistic}'], expected_rolling[(v, statistic)], equal_nan=True), msg
+    print('Test passed.')
+
+
+if __name__ == '__main__':
+    # Daily summaries for the cities we've downloaded
+    aggregator = aggregate_csv({'Edinburgh': 'Edinburgh_hourly_temperature_2m_cloud_cover.csv',
+                                'Glasgow': 'Glasgow_hourly_temperature_2m_cloud_cover.csv'}, chunk_size=24)
+    print(aggregator.summary())
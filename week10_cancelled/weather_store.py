@@ -0,0 +1,198 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Instead of joining dataframes for different cities with pd.concat() or merge()
+# (which copies all the data every time), keep all the cities in one big
+# array on disk, with the same hourly time axis for everyone:
+#     data[city, time, variable]
+# Missing values are NaN. The array is memory-mapped, so we only ever
+# load the parts we actually use.
+
+
+class WeatherStore():
+    '''
+    Weather data for several cities, on a shared hourly time axis,
+    stored as a (city, time, variable) float32 array in a file on disk.
+
+    Input:
+        path (str): folder for the store. If it already exists, the store is
+            opened, otherwise a new one is created with:
+        start, end (str or pd.Timestamp): first and last hour of the time axis
+        variables (list): names of the weather variables (e.g. 'temperature_2m')
+    '''
+
+    def __init__(self, path, start=None, end=None, variables=None):
+        self.path = path
+        self.data_filename = os.path.join(path, 'data.f32')
+        self.info_filename = os.path.join(path, 'info.json')
+
+        if os.path.exists(self.info_filename):
+            with open(self.info_filename, 'r') as f:
+                self.info = json.load(f)
+        else:
+            if start is None or end is None or variables is None:
+                raise ValueError(f'No store in {path}: give start, end, and variables to create one.')
+
+            os.makedirs(path, exist_ok=True)
+            self.info = {'start': pd.Timestamp(start).isoformat(),
+                         'number_of_times': len(pd.date_range(start, end, freq='h')),
+                         'variables': list(variables),
+                         'cities': []}
+            open(self.data_filename, 'wb').close()
+            self.save_info()
+
+        self.times = pd.date_range(self.info['start'], periods=self.info['number_of_times'], freq='h')
+        self.variables = self.info['variables']
+        self.open()
+
+    def save_info(self):
+        with open(self.info_filename + '.tmp', 'w') as f:
+            json.dump(self.info, f)
+        os.replace(self.info_filename + '.tmp', self.info_filename)
+
+    def open(self):
+        '''
+        Memory-map the data file (again, after it has grown).
+        '''
+        shape = (len(self.cities), len(self.times), len(self.variables))
+        if shape[0] == 0:
+            self.data = np.zeros(shape, dtype=np.float32)
+        else:
+            self.data = np.memmap(self.data_filename, dtype=np.float32, mode='r+', shape=shape)
+
+    @property
+    def cities(self):
+        return self.info['cities']
+
+    def city_block(self, data):
+        '''
+        Put a dataframe from get_weather_data() (a time column plus one column
+        per variable) on the store's time axis, as a (time, variable) array.
+        Times outside the time axis are ignored.
+        '''
+        block = np.full((len(self.times), len(self.variables)), np.nan, dtype=np.float32)
+
+        # Position of each row on the time axis
+        positions = self.times.get_indexer(pd.to_datetime(data['time']))
+        inside = positions >= 0
+
+        for j, v in enumerate(self.variables):
+            if v in data:
+                block[positions[inside], j] = data[v].to_numpy()[inside]
+
+        return block
+
+    def add_city(self, city_name, data):
+        '''
+        Add (or replace) the data for a city. A new city is appended
+        to the end of the file, without touching the other cities.
+        '''
+        block = self.city_block(data)
+
+        if city_name in self.cities:
+            # Overwrite in place
+            self.data[self.cities.index(city_name)] = block
+            self.data.flush()
+            return
+
+        with open(self.data_filename, 'ab') as f:
+            f.write(block.tobytes())
+
+        self.info['cities'].append(city_name)
+        self.save_info()
+        self.open()
+
+    def city(self, city_name):
+        '''
+        (time, variable) array for one city (a view, nothing is copied).
+        '''
+        return self.data[self.cities.index(city_name)]
+
+    def variable(self, variable):
+        '''
+        (city, time) array for one variable (a view, nothing is copied).
+        '''
+        return self.data[:, :, self.variables.index(variable)]
+
+    def outer(self):
+        '''
+        Outer join of all the cities: every time, with NaN where a city
+        has no data. This is just the (city, time, variable) array itself.
+        '''
+        return self.data
+
+    def common_times(self):
+        '''
+        Boolean array over the time axis: True where every city
+        has a value for every variable.
+        '''
+        return ~np.isnan(self.data).any(axis=(0, 2))
+
+    def inner(self):
+        '''
+        Inner join of all the cities: same as outer(), but with the times
+        where any city is missing data masked out. The masked array uses
+        the same memory as the store, nothing is copied.
+        '''
+        mask = np.broadcast_to(~self.common_times()[np.newaxis, :, np.newaxis], self.data.shape)
+        return np.ma.masked_array(self.data, mask=mask, copy=False)
+
+    def to_long(self, how='outer'):
+        '''
+        Long-format dataframe (columns time, city, variable, value),
+        e.g. for plotting with seaborn. This copies the data,
+        so only use it when needed.
+        '''
+        if how == 'outer':
+            keep = np.ones(len(self.times), dtype=bool)
+        elif how == 'inner':
+            keep = self.common_times()
+        else:
+            raise ValueError(f'how should be "outer" or "inner", not {how}.')
+
+        n_cities, n_times, n_variables = len(self.cities), keep.sum(), len(self.variables)
+        values = self.data[:, keep, :]
+
+        return pd.DataFrame({'time': np.tile(np.repeat(self.times[keep], n_variables), n_cities),
+                             'city': np.repeat(self.cities, n_times * n_variables),
+                             'variable': np.tile(self.variables, n_cities * n_times),
+                             'value': values.ravel()})
+
+
+def test_weather_store():
+    '''
+    Convenience function to test WeatherStore with 2 cities with gaps.
+    '''
+    import tempfile
+
+    times = pd.date_range('2025-11-24', periods=48, freq='h')
+    edinburgh = pd.DataFrame({'time': times, 'temperature_2m': np.arange(48.0), 'cloud_cover': 100.0})
+    glasgow = pd.DataFrame({'time': times[10:], 'temperature_2m': -np.arange(38.0), 'cloud_cover': 50.0})
+
+    with tempfile.TemporaryDirectory() as path:
+        store = WeatherStore(path, '2025-11-24', '2025-11-25 23:00', ['temperature_2m', 'cloud_cover'])
+        store.add_city('Edinburgh', edinburgh)
+        store.add_city('Glasgow', glasgow)
+
+        assert store.data.shape == (2, 48, 2)
+        assert store.city('Edinburgh')[5, 0] == 5.0
+        assert np.isnan(store.city('Glasgow')[:10]).all() and store.city('Glasgow')[10, 0] == 0.0
+
+        # Views share memory with the store
+        assert np.shares_memory(store.variable('cloud_cover'), store.data)
+        assert np.shares_memory(store.inner().data, store.data)
+        assert store.inner().count() == 2 * 38 * 2
+
+        long_data = store.to_long('inner')
+        assert len(long_data) == 2 * 38 * 2
+        row = long_data.loc[(long_data['city'] == 'Glasgow') & (long_data['variable'] == 'temperature_2m')].iloc[1]
+        assert row['time'] == times[11] and row['value'] == -1.0
+
+        # Reopening the store gives the same data
+        store = WeatherStore(path)
+        assert store.cities == ['Edinburgh', 'Glasgow'] and store.city('Edinburgh')[47, 0] == 47.0
+
+    print('Test passed.')
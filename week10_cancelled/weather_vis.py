@@ -2,7 +2,24 @@ import requests
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
+import contextlib
+import json
 import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# profiling.py is shared by all the weeks, in the folder above this one.
+# Without it (e.g. if this folder is copied on its own), nothing is measured.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import profiling
+except ImportError:
+    profiling = SimpleNamespace(profile=lambda function: function,
+                                stage=lambda name: contextlib.nullcontext(),
+                                from_command_line=lambda argv=None: None)
 
 plt.rcParams.update({'font.size': 22})
 
@@ -13,48 +30,392 @@ plt.rcParams.update({'font.size': 22})
 #    (convert to long format (melt), joining/merging dataframes)
 
 
-def get_weather_data(city_name, frequency, variables):
-    # Look for existing CSV (to avoid repeating API requests unnecessarily)
-    filename = f'{city_name}_{frequency}'
-    for v in variables:
-        filename += f'_{v}'
-    filename += '.csv'
+# Open-Meteo API endpoints (change these to test against a local server)
+GEOCODING_URL = 'https://geocoding-api.open-meteo.com/v1/search'
+FORECAST_URL = 'https://api.open-meteo.com/v1/forecast'
+
+# Only one thread at a time can read or write the geocoding file
+geocoding_lock = threading.Lock()
+
+
+def missing_ranges(start, end, covered):
+    '''
+    Find the date ranges between start and end (inclusive, as pd.Timestamps
+    for whole days) which are not in any of the covered (start, end) ranges.
+    '''
+    one_day = pd.Timedelta(days=1)
+    missing = []
+    current = start
+
+    for covered_start, covered_end in sorted(covered):
+        if covered_end < current:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > current:
+            missing.append((current, covered_start - one_day))
+        current = max(current, covered_end + one_day)
+
+    if current <= end:
+        missing.append((current, end))
+
+    return missing
+
+
+def update_ranges(ranges, start, end, now, ttl):
+    '''
+    Add the date range from start to end (pd.Timestamps), fetched at time now,
+    to a list of [start, end, fetched] ranges (dates as strings), and return
+    the new list, sorted by date. So that the list doesn't keep growing:
+        - older ranges lose the dates which were just fetched again,
+        - ranges which have expired (older than ttl seconds) are merged when
+          they touch, keeping the oldest fetch time (they'll be fetched
+          again anyway, if we ask for them).
+    '''
+    one_day = pd.Timedelta(days=1)
+    new_ranges = [[start, end, now]]
+
+    for r_start, r_end, fetched in ranges:
+        r_start, r_end = pd.Timestamp(r_start), pd.Timestamp(r_end)
+
+        # Keep the parts before and after the new range
+        if r_start < start:
+            new_ranges.append([r_start, min(r_end, start - one_day), fetched])
+        if r_end > end:
+            new_ranges.append([max(r_start, end + one_day), r_end, fetched])
+
+    new_ranges.sort(key=lambda r: r[0])
+
+    merged = []
+    for r in new_ranges:
+        expired = ttl is not None and now - r[2] > ttl
+        if merged and expired and merged[-1][3] and r[0] <= merged[-1][1] + one_day:
+            merged[-1][1] = max(merged[-1][1], r[1])
+            merged[-1][2] = min(merged[-1][2], r[2])
+        else:
+            merged.append(r + [expired])
+
+    return [[r_start.strftime('%Y-%m-%d'), r_end.strftime('%Y-%m-%d'), fetched]
+            for r_start, r_end, fetched, expired in merged]
+
+
+@profiling.profile
+def geocode(city_name, session=requests, cache_dir='weather_cache'):
+    '''
+    Get latitude, longitude, and time zone for a city.
+    These never change, so results are saved in geocoding.json in cache_dir,
+    and we only ask the API about each city once.
+    session can be a requests.Session, to reuse its connections.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = os.path.join(cache_dir, 'geocoding.json')
+
+    with geocoding_lock:
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                known_cities = json.load(f)
+        else:
+            known_cities = {}
+
+    if city_name in known_cities:
+        return known_cities[city_name]
 
-    if not os.path.exists(filename):
-        # Get city information
-        params_dict = {'name': city_name, 'count': 1}
-        city_info = requests.get('https://geocoding-api.open-meteo.com/v1/search', params=params_dict).json()
+    # Get city information
+    params_dict = {'name': city_name, 'count': 1}
+    r = session.get(GEOCODING_URL, params=params_dict)
+    r.raise_for_status()
 
-        # Extract the first result in the list
-        city_info = city_info['results'][0]
+    # Extract the first result in the list
+    city_info = r.json()['results'][0]
+    city_info = {'latitude': city_info['latitude'],
+                 'longitude': city_info['longitude'],
+                 'timezone': city_info['timezone']}
 
-        # Get latitude, longitude, and time zone
-        latitude, longitude = city_info['latitude'], city_info['longitude']
-        time_zone = city_info['timezone']
+    # Add it to the file (re-reading it, in case another thread added a city meanwhile)
+    with geocoding_lock:
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                known_cities = json.load(f)
+        known_cities[city_name] = city_info
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(known_cities, f)
+        os.replace(filename + '.tmp', filename)
 
+    return city_info
+
+
+@profiling.profile
+def get_weather_data(city_name, frequency, variables, start_date=None, end_date=None,
+                     ttl=3600, cache_dir='weather_cache', session=requests):
+    '''
+    Get weather data for a city from the Open-Meteo API, between start_date
+    and end_date (strings like '2025-11-24'; by default, the next 7 days),
+    as a dataframe with a time column and one column per variable.
+
+    Data is cached in cache_dir, in a Parquet file per city and frequency,
+    so we only request what we don't have yet: variables we've never
+    asked for, dates outside what we've already got, or data which was
+    fetched more than ttl seconds ago (ttl=None means it never expires).
+    session can be a requests.Session, to reuse its connections.
+    '''
+    # Which dates do we want?
+    if start_date is None:
+        start_date = pd.Timestamp.now().normalize()
+    if end_date is None:
+        end_date = pd.Timestamp(start_date) + pd.Timedelta(days=6)
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+
+    # Look for existing data (to avoid repeating API requests unnecessarily)
+    os.makedirs(cache_dir, exist_ok=True)
+    data_filename = os.path.join(cache_dir, f'{city_name}_{frequency}.parquet')
+    info_filename = os.path.join(cache_dir, f'{city_name}_{frequency}.json')
+
+    if os.path.exists(info_filename):
+        with profiling.stage('read_cache'):
+            with open(info_filename, 'r') as f:
+                info = json.load(f)
+            data = pd.read_parquet(data_filename)
+    else:
+        # Keep latitude, longitude, and time zone; for each variable, we'll also keep
+        # a list of the date ranges we have, and when each one was fetched
+        info = dict(geocode(city_name, session, cache_dir), ranges={})
+        data = pd.DataFrame(index=pd.DatetimeIndex([], name='time'))
+
+    # For each variable, find the date ranges we don't have (or which are too old)
+    now = time.time()
+    to_fetch = {}
+    for v in variables:
+        covered = [(pd.Timestamp(r_start), pd.Timestamp(r_end))
+                   for r_start, r_end, fetched in info['ranges'].get(v, [])
+                   if ttl is None or now - fetched <= ttl]
+
+        for date_range in missing_ranges(start_date, end_date, covered):
+            # Group variables missing the same dates, to get them in one request
+            to_fetch.setdefault(date_range, []).append(v)
+
+    if not to_fetch:
+        print('We already have the data!')
+
+    for (range_start, range_end), range_variables in to_fetch.items():
         # Create a dictionary for the parameters I need
-        params_dict = {'timezone': time_zone,
-                       'latitude': latitude,
-                       'longitude': longitude,
-                       frequency: variables}
+        params_dict = {'timezone': info['timezone'],
+                       'latitude': info['latitude'],
+                       'longitude': info['longitude'],
+                       'start_date': range_start.strftime('%Y-%m-%d'),
+                       'end_date': range_end.strftime('%Y-%m-%d'),
+                       frequency: range_variables}
 
         # Request data from the API
-        r = requests.get('https://api.open-meteo.com/v1/forecast', params=params_dict)
+        with profiling.stage('network'):
+            r = session.get(FORECAST_URL, params=params_dict)
+            r.raise_for_status()
 
         # Parse the JSON data to a pandas dataframe (much easier than dealing with dicts!)
-        data = pd.DataFrame(r.json()['hourly'])
-        data.to_csv(filename, index=False)
-    else:
-        print('We already have the file!')
-        data = pd.read_csv(filename)
+        with profiling.stage('parse'):
+            new_data = pd.DataFrame(r.json()[frequency])
+        with profiling.stage('to_datetime'):
+            new_data['time'] = pd.to_datetime(new_data['time'])
+        new_data = new_data.set_index('time').astype('float64')
+
+        # Merge with what we had (new values replace old ones)
+        data = new_data.combine_first(data)
+
+        # Keep track of the dates we now have for each variable
+        for v in range_variables:
+            info['ranges'][v] = update_ranges(info['ranges'].get(v, []), range_start, range_end, now, ttl)
+
+    if to_fetch:
+        with profiling.stage('write_cache'):
+            data.sort_index().to_parquet(data_filename)
+            with open(info_filename, 'w') as f:
+                json.dump(info, f)
+
+    # Only return the dates and variables we asked for
+    # (times are already proper datetime objects, no need to convert them)
+    data = data.loc[(data.index >= start_date) & (data.index < end_date + pd.Timedelta(days=1)), variables]
+
+    return data.reset_index()
+
 
-    # Make sure the time column values are proper datetime objects
-    data['time'] = pd.to_datetime(data['time'])
+@profiling.profile
+def get_weather_data_many(cities, frequency, variables, start_date=None, end_date=None,
+                          ttl=3600, cache_dir='weather_cache', max_concurrency=16):
+    '''
+    Same as get_weather_data(), for a list of cities at once.
+    Requests for different cities are made at the same time, in up to
+    max_concurrency threads sharing one requests.Session (so connections
+    to the API are reused instead of opened again for every request).
 
-    return data
+    Returns a dictionary {city name: dataframe}.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with requests.Session() as session:
+        # Keep enough connections open for all the threads
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=max_concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {city: executor.submit(get_weather_data, city, frequency, variables, start_date, end_date,
+                                             ttl, cache_dir, session)
+                       for city in cities}
+            all_data = {city: future.result() for city, future in futures.items()}
+
+    return all_data
+
+
+def start_fake_open_meteo(requests_made, delay=0):
+    '''
+    Start a small local server which pretends to be the Open-Meteo API
+    (so we can test without internet), and point GEOCODING_URL and
+    FORECAST_URL to it. Every request is added to the requests_made list,
+    and takes delay seconds to answer.
+    Fake temperatures are the hour of the day, and fake cloud cover is the
+    day of the month. Call stop_fake_open_meteo() when done.
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    global GEOCODING_URL, FORECAST_URL
+
+    class FakeOpenMeteo(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            requests_made.append((url.path, params))
+            time.sleep(delay)
+
+            if url.path == '/v1/search':
+                result = {'results': [{'latitude': 55.95, 'longitude': -3.19, 'timezone': 'Europe/London'}]}
+            else:
+                times = pd.date_range(params['start_date'][0], pd.Timestamp(params['end_date'][0]) + pd.Timedelta(hours=23), freq='h')
+                hourly = {'time': list(times.strftime('%Y-%m-%dT%H:%M'))}
+                for v in params['hourly']:
+                    hourly[v] = [float(t.hour) if v == 'temperature_2m' else float(t.day) for t in times]
+                result = {'hourly': hourly}
+
+            body = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenMeteo)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    server.real_urls = GEOCODING_URL, FORECAST_URL
+    GEOCODING_URL = f'http://127.0.0.1:{server.server_port}/v1/search'
+    FORECAST_URL = f'http://127.0.0.1:{server.server_port}/v1/forecast'
+
+    return server
+
+
+def stop_fake_open_meteo(server):
+    '''
+    Stop the server from start_fake_open_meteo(), and go back to the real API.
+    '''
+    global GEOCODING_URL, FORECAST_URL
+    GEOCODING_URL, FORECAST_URL = server.real_urls
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_weather_data():
+    '''
+    Convenience function to test get_weather_data() and its cache,
+    using a fake Open-Meteo API (see start_fake_open_meteo()).
+    '''
+    import tempfile
+
+    requests_made = []
+    server = start_fake_open_meteo(requests_made)
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # First request: geocoding + data
+            data = get_weather_data('Edinburgh', 'hourly', ['temperature_2m'], '2025-11-24', '2025-11-25', cache_dir=cache_dir)
+            assert len(requests_made) == 2, f'Expected 2 requests, got {len(requests_made)}.'
+            assert list(data.columns) == ['time', 'temperature_2m']
+            assert len(data) == 48 and data['temperature_2m'].iloc[5] == 5.0
+            assert pd.api.types.is_datetime64_any_dtype(data['time'])
+
+            # Same request again: everything comes from the cache
+            get_weather_data('Edinburgh', 'hourly', ['temperature_2m'], '2025-11-24', '2025-11-25', cache_dir=cache_dir)
+            assert len(requests_made) == 2, 'Cached data was requested again.'
+
+            # New variable: only that variable is requested
+            data = get_weather_data('Edinburgh', 'hourly', ['temperature_2m', 'cloud_cover'], '2025-11-24', '2025-11-25', cache_dir=cache_dir)
+            assert len(requests_made) == 3 and requests_made[-1][1]['hourly'] == ['cloud_cover']
+            assert data['cloud_cover'].iloc[30] == 25.0
+
+            # Longer date range: only the new days are requested
+            data = get_weather_data('Edinburgh', 'hourly', ['temperature_2m', 'cloud_cover'], '2025-11-23', '2025-11-26', cache_dir=cache_dir)
+            new_ranges = sorted((p['start_date'][0], p['end_date'][0]) for path, p in requests_made[3:])
+            assert new_ranges == [('2025-11-23', '2025-11-23'), ('2025-11-26', '2025-11-26')], new_ranges
+            assert len(data) == 96 and not data.isna().any().any()
+
+            # Expired data is requested again
+            get_weather_data('Edinburgh', 'hourly', ['temperature_2m'], '2025-11-24', '2025-11-24', ttl=0, cache_dir=cache_dir)
+            assert requests_made[-1][1]['start_date'] == ['2025-11-24'] and len(requests_made) == 6
+
+            # Refreshing expired data over and over doesn't make the list of date ranges grow
+            for i in range(10):
+                get_weather_data('Edinburgh', 'hourly', ['temperature_2m'], '2025-11-23', '2025-11-26', ttl=0, cache_dir=cache_dir)
+            with open(os.path.join(cache_dir, 'Edinburgh_hourly.json'), 'r') as f:
+                ranges = json.load(f)['ranges']['temperature_2m']
+            assert len(ranges) == 1 and ranges[0][:2] == ['2025-11-23', '2025-11-26'], ranges
+    finally:
+        stop_fake_open_meteo(server)
+
+    print('Test passed.')
+
+
+def test_get_weather_data_many(number_of_cities=50, delay=0.2):
+    '''
+    Convenience function to test that get_weather_data_many() makes its requests
+    at the same time (with a fake API which takes delay seconds to answer
+    each request), and that each city is only geocoded once.
+    '''
+    import tempfile
+
+    requests_made = []
+    server = start_fake_open_meteo(requests_made, delay)
+    cities = [f'City {i}' for i in range(number_of_cities)]
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            all_data = get_weather_data_many(cities, 'hourly', ['temperature_2m'], '2025-11-24', '2025-11-24',
+                                             cache_dir=cache_dir, max_concurrency=number_of_cities)
+            elapsed = time.perf_counter() - start
+
+            assert len(requests_made) == 2 * number_of_cities, f'Expected {2 * number_of_cities} requests, got {len(requests_made)}.'
+            assert all(len(all_data[city]) == 24 for city in cities)
+            msg = f'Took {elapsed:.2f} s, requests were not made at the same time.'
+            assert elapsed < 2 * number_of_cities * delay / 4, msg
+
+            # Coordinates are remembered: a new variable only needs the forecast requests
+            with open(os.path.join(cache_dir, 'geocoding.json')) as f:
+                assert len(json.load(f)) == number_of_cities
+            get_weather_data_many(cities, 'hourly', ['cloud_cover'], '2025-11-24', '2025-11-24', cache_dir=cache_dir)
+            geocoding_requests = [path for path, params in requests_made if path == '/v1/search']
+            assert len(geocoding_requests) == number_of_cities, 'Cities were geocoded again.'
+    finally:
+        stop_fake_open_meteo(server)
+
+    print('Test passed.')
 
 
 if __name__ == '__main__':
+    # Run with --profile report.json to see how long each stage takes
+    # (see profiling.py)
+    profiling.from_command_line()
+
     city_name = 'Edinburgh'
     frequency = 'hourly'
     variables = ['temperature_2m', 'cloud_cover']
@@ -97,6 +458,9 @@ if __name__ == '__main__':
     city_name = 'Glasgow'
     glasgow_data = get_weather_data(city_name, frequency, variables)
 
+    # Or get several cities at once
+    # all_data = get_weather_data_many(['Edinburgh', 'Glasgow', 'Aberdeen', 'Dundee'], frequency, variables)
+
     # Remove one data point each day, at a different time in Edinburgh and Glasgow,
     # just to demonstrate joining dataframes with different missing values
     edinburgh_data_gaps = edinburgh_data.loc[edinburgh_data['time'].dt.hour != 2]
@@ -114,6 +478,15 @@ if __name__ == '__main__':
     # sns.relplot(data=edi_gla_data, x='time', y='temperature_2m', hue='cloud_cover', size='cloud_cover', col='city')
     # plt.show()
 
+    # # For lots of cities, keep them all on the same time axis in a WeatherStore
+    # # (see weather_store.py) instead of joining dataframes:
+    # from weather_store import WeatherStore
+    # store = WeatherStore('weather_store', edinburgh_data['time'].min(), edinburgh_data['time'].max(), variables)
+    # store.add_city('Edinburgh', edinburgh_data_gaps)
+    # store.add_city('Glasgow', glasgow_data_gaps)
+    # sns.relplot(data=store.to_long('inner'), x='time', y='value', hue='city', row='variable', kind='line')
+    # plt.show()
+
     # # We could also merge the 2 dataframes like this (try the different ways and spot which times are missing!)
     # # How you choose to join dataframes depends on what you need to do with the data after.
     edi_gla_data = edinburgh_data_gaps.merge(glasgow_data_gaps, on='time', suffixes=['_edi', '_gla'])
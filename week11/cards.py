@@ -1,24 +1,141 @@
+import numpy as np
+
+# Suits in a fixed order, so each card can be stored as a single number:
+# code = (value - 1) * 4 + suit index, from 0 (ace of clubs) to 51 (king of spades)
+SUITS = ('clubs', 'diamonds', 'hearts', 'spades')
+SPECIAL_CARDS = {1: 'ace', 11: 'jack', 12: 'queen', 13: 'king'}
+
+
 class Card():
-    
+    # No __dict__ for each card, just these 2 attributes (saves memory)
+    __slots__ = ('value', 'suit')
+
     def __init__(self, v, s):
         self.value = v
         self.suit = s
         # can also exit with an error if necessary
-    
-    def __str__(self):
-        special_cards = {1: 'ace', 11: 'jack', 12: 'queen', 13: 'king'}
 
-        if self.value not in special_cards:
+    def __str__(self):
+        if self.value not in SPECIAL_CARDS:
             return f'{self.value} of {self.suit}'
         else:
-            return f'{special_cards[self.value]} of {self.suit}'
+            return f'{SPECIAL_CARDS[self.value]} of {self.suit}'
+
+    @property
+    def code(self):
+        '''
+        The card as a number from 0 to 51 (see SUITS).
+        '''
+        return (self.value - 1) * 4 + SUITS.index(self.suit)
+
+    @classmethod
+    def from_code(cls, code):
+        return cls(int(code) // 4 + 1, SUITS[int(code) % 4])
+
+
+# Name of each card, by code, worked out once
+CARD_NAMES = np.array([str(Card.from_code(code)) for code in range(52)])
+
+
+class Deck():
+    '''
+    A deck of cards stored as a Numpy array of uint8 codes (see SUITS),
+    with a Numpy random number generator (or a seed for one) to shuffle it.
+    '''
+
+    def __init__(self, rng=None):
+        self.cards = np.arange(52, dtype=np.uint8)
+        self.rng = np.random.default_rng(rng)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def shuffle(self):
+        self.rng.shuffle(self.cards)
+
+    def deal(self, number_of_cards):
+        '''
+        Take cards from the top of the deck, and return their codes.
+        '''
+        if number_of_cards > len(self.cards):
+            raise ValueError(f'Cannot deal {number_of_cards} cards, only {len(self.cards)} left in the deck.')
+
+        hand, self.cards = self.cards[:number_of_cards], self.cards[number_of_cards:]
+        return hand
+
+
+def shuffled_decks(number_of_decks, rng=None):
+    '''
+    Many shuffled decks at once, as a (number_of_decks, 52) array of codes.
+    '''
+    rng = np.random.default_rng(rng)
+    decks = np.broadcast_to(np.arange(52, dtype=np.uint8), (number_of_decks, 52))
+    return rng.permuted(decks, axis=1)
+
+
+def deal_hands(number_of_deals, number_of_players=4, cards_per_hand=5, rng=None):
+    '''
+    Shuffle number_of_deals decks and deal cards_per_hand cards to
+    each player from each deck (one card at a time to each player in turn,
+    like a real deal). Returns a (number_of_deals, number_of_players,
+    cards_per_hand) array of card codes.
+    '''
+    if number_of_players * cards_per_hand > 52:
+        raise ValueError(f'Cannot deal {cards_per_hand} cards to {number_of_players} players from one deck.')
+
+    decks = shuffled_decks(number_of_deals, rng)
+    dealt = decks[:, :number_of_players * cards_per_hand]
+    return dealt.reshape(number_of_deals, cards_per_hand, number_of_players).transpose(0, 2, 1)
+
+
+def card_names(codes):
+    '''
+    Names of cards (an array of any shape of codes), without making Card objects.
+    '''
+    return CARD_NAMES[np.asarray(codes)]
+
+
+def to_cards(codes):
+    '''
+    Card objects for an array of codes (nested lists with the same shape),
+    for when we really need them.
+    '''
+    codes = np.asarray(codes)
+    if codes.ndim == 0:
+        return Card.from_code(codes)
+    return [to_cards(c) for c in codes]
+
+
+def test_cards():
+    '''
+    Convenience function to test the card codes and dealing.
+    '''
+    for code in range(52):
+        card = Card.from_code(code)
+        assert card.code == code and str(card) == CARD_NAMES[code]
+    assert str(Card(1, 'hearts')) == 'ace of hearts' and Card(1, 'hearts').code == 2
+
+    hands = deal_hands(1000, number_of_players=4, cards_per_hand=13, rng=0)
+    assert hands.shape == (1000, 4, 13) and hands.dtype == np.uint8
+
+    # Every deal uses each card exactly once
+    assert (np.sort(hands.reshape(1000, 52), axis=1) == np.arange(52)).all()
+
+    # Same seed, same deal
+    assert (deal_hands(10, rng=42) == deal_hands(10, rng=42)).all()
+    assert str(to_cards(hands)[0][0][0]) == card_names(hands)[0, 0, 0]
+    print('Test passed.')
 
 
+if __name__ == '__main__':
+    my_card = Card(1, 'hearts')
+    print(my_card.value) # expect 4
+    print(my_card.suit) # expect 'clubs'
+    print(my_card) # expect 'ace of hearts'
 
-my_card = Card(1, 'hearts')
-print(my_card.value) # expect 4
-print(my_card.suit) # expect 'clubs'
-print(my_card) # expect 'ace of hearts'
+    # my_card = Card(63, 'ponies')
+    # print(my_card.value, my_card.suit)
 
-# my_card = Card(63, 'ponies')
-# print(my_card.value, my_card.suit)
+    # Deal a million games of 4 hands of 5 cards
+    # hands = deal_hands(1_000_000, number_of_players=4, cards_per_hand=5)
+    # print(card_names(hands[0]))
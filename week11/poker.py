@@ -0,0 +1,281 @@
+import functools
+import itertools
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+import cards
+
+# Ranking poker hands with lookup tables, for simulating lots of deals.
+#
+# Each 5-card hand gets a score from 1 (7-5-4-3-2 high card) to 7462
+# (royal flush): two hands with the same score are a tie, a higher score wins.
+# The scores come from tables worked out once (with the slow evaluator,
+# naive_rank()) and saved to disk:
+#     - flush_table: score of a flush, indexed by a 13-bit mask of its ranks
+#     - rank_table: score of any other hand, indexed by its 5 ranks sorted
+#       (as a base-13 number)
+# Then scoring a whole array of hands (card codes from cards.py) is just
+# a few Numpy operations and 2 lookups.
+
+CATEGORIES = ('high card', 'pair', 'two pair', 'three of a kind', 'straight',
+              'flush', 'full house', 'four of a kind', 'straight flush')
+
+TABLES_FILENAME = 'poker_tables.npz'
+TABLES_VERSION = 1
+
+# Rank of each card code, from 0 (two) to 12 (ace), and its suit
+CODE_RANKS = np.array([(code // 4 - 1) % 13 for code in range(52)], dtype=np.uint8)
+CODE_SUITS = np.array([code % 4 for code in range(52)], dtype=np.uint8)
+
+# Place values for the sorted ranks
+POWERS_OF_13 = 13**np.arange(5)
+
+
+def naive_rank(hand):
+    '''
+    Rank a hand of 5 Card objects, one at a time.
+
+    Input:
+        hand (list): 5 Card objects
+    Output:
+        (category, tie_break) (tuple): category is an index in CATEGORIES,
+            tie_break a tuple of ranks (0 = two, ..., 12 = ace) to compare
+            hands in the same category. Better hands compare greater.
+    '''
+    ranks = sorted(((card.value - 2) % 13 for card in hand), reverse=True)
+    flush = len({card.suit for card in hand}) == 1
+    return rank_of(ranks, flush)
+
+
+def rank_of(ranks, flush):
+    '''
+    (category, tie_break) of a hand with the given ranks (from highest to lowest),
+    see naive_rank().
+    '''
+    # Ranks in groups of the same rank, biggest groups first, then highest rank first
+    groups = sorted(Counter(ranks).items(), key=lambda g: (g[1], g[0]), reverse=True)
+    counts = [count for rank, count in groups]
+    tie_break = tuple(rank for rank, count in groups)
+
+    straight = len(groups) == 5 and (ranks[0] - ranks[4] == 4 or ranks == [12, 3, 2, 1, 0])
+    if straight:
+        # An ace can be low, 5-4-3-2-A
+        tie_break = (3,) if ranks[0] == 12 and ranks[1] == 3 else (ranks[0],)
+
+    if straight and flush:
+        category = 8
+    elif counts[0] == 4:
+        category = 7
+    elif counts[:2] == [3, 2]:
+        category = 6
+    elif flush:
+        category = 5
+    elif straight:
+        category = 4
+    elif counts[0] == 3:
+        category = 3
+    elif counts[:2] == [2, 2]:
+        category = 2
+    elif counts[0] == 2:
+        category = 1
+    else:
+        category = 0
+
+    return category, tie_break
+
+
+def build_tables():
+    '''
+    Work out the lookup tables (see the top of this file) with rank_of().
+    '''
+    # Every possible hand, as (ranks, flush)
+    hands = []
+    for ranks in itertools.combinations_with_replacement(range(12, -1, -1), 5):
+        if len(set(ranks)) > 1:
+            hands.append((list(ranks), False))
+        if len(set(ranks)) == 5:
+            hands.append((list(ranks), True))
+
+    # Number the different (category, tie_break) from the worst to the best
+    ranked = [rank_of(ranks, flush) for ranks, flush in hands]
+    scores = {r: score for score, r in enumerate(sorted(set(ranked)), start=1)}
+
+    flush_table = np.zeros(1 << 13, dtype=np.uint16)
+    rank_table = np.zeros(13**5, dtype=np.uint16)
+    for (ranks, flush), r in zip(hands, ranked):
+        if flush:
+            flush_table[sum(1 << rank for rank in ranks)] = scores[r]
+        else:
+            # Lowest rank in the lowest place, like sorted_ranks() below
+            rank_table[np.dot(ranks[::-1], POWERS_OF_13)] = scores[r]
+
+    # Category of each score
+    categories = np.zeros(len(scores) + 1, dtype=np.uint8)
+    for r, score in scores.items():
+        categories[score] = r[0]
+
+    return flush_table, rank_table, categories
+
+
+@functools.lru_cache(maxsize=None)
+def load_tables(filename=TABLES_FILENAME):
+    '''
+    Lookup tables, from the file if it exists (and has the right version),
+    or worked out and saved there the first time (only once per run).
+    '''
+    if os.path.exists(filename):
+        try:
+            with np.load(filename) as saved:
+                if int(saved['version']) == TABLES_VERSION:
+                    return saved['flush_table'], saved['rank_table'], saved['categories']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    flush_table, rank_table, categories = build_tables()
+    np.savez(filename, version=TABLES_VERSION, flush_table=flush_table,
+             rank_table=rank_table, categories=categories)
+    return flush_table, rank_table, categories
+
+
+def sorted_ranks(ranks):
+    '''
+    Sort the 5 columns of a (N, 5) array (a sorting network: 9 compare
+    and swaps of whole columns, faster than np.sort() on short rows).
+    '''
+    r = [ranks[:, i] for i in range(5)]
+    for i, j in [(0, 1), (3, 4), (2, 4), (2, 3), (0, 3), (0, 2), (1, 4), (1, 3), (1, 2)]:
+        r[i], r[j] = np.minimum(r[i], r[j]), np.maximum(r[i], r[j])
+    return r
+
+
+def evaluate_five(hands, filename=TABLES_FILENAME):
+    '''
+    Scores of 5-card hands, from an (N, 5) array of card codes.
+    '''
+    flush_table, rank_table, categories = load_tables(filename)
+    ranks = CODE_RANKS[hands]
+    suits = CODE_SUITS[hands]
+
+    flush = (suits == suits[:, :1]).all(axis=1)
+    r = sorted_ranks(ranks)
+
+    index = r[0].astype(np.int32)
+    for i in range(1, 5):
+        index += r[i] * POWERS_OF_13[i]
+    scores = rank_table[index]
+
+    if flush.any():
+        mask = np.left_shift(1, ranks[flush].astype(np.uint16)).sum(axis=1)
+        scores[flush] = flush_table[mask]
+    return scores
+
+
+def evaluate(hands, filename=TABLES_FILENAME):
+    '''
+    Scores of poker hands (see the top of this file).
+
+    Input:
+        hands (array): card codes (see cards.py), of shape (..., number_of_cards),
+            with at least 5 cards per hand. With more than 5 cards
+            (e.g. 7 in Texas hold'em), the score is for the best 5 of them.
+    Output:
+        scores (array): score of each hand, shape hands.shape[:-1]
+    '''
+    hands = np.asarray(hands)
+    number_of_cards = hands.shape[-1]
+    if number_of_cards < 5:
+        raise ValueError(f'A poker hand needs at least 5 cards, not {number_of_cards}.')
+
+    flat = hands.reshape(-1, number_of_cards)
+    scores = np.zeros(len(flat), dtype=np.uint16)
+    for five in itertools.combinations(range(number_of_cards), 5):
+        np.maximum(scores, evaluate_five(flat[:, five], filename), out=scores)
+
+    return scores.reshape(hands.shape[:-1])
+
+
+def category_names(scores, filename=TABLES_FILENAME):
+    '''
+    Name of the category of each score, e.g. 'full house'.
+    '''
+    categories = load_tables(filename)[2]
+    return np.array(CATEGORIES)[categories[scores]]
+
+
+def winners(hands):
+    '''
+    For hands dealt to several players (shape (..., number_of_players, number_of_cards)),
+    a boolean array marking the player(s) with the best hand in each deal.
+    '''
+    scores = evaluate(hands)
+    return scores == scores.max(axis=-1, keepdims=True)
+
+
+def test_evaluate():
+    '''
+    Convenience function to test the tables and the vectorised evaluator
+    against naive_rank().
+    '''
+    flush_table, rank_table, categories = load_tables()
+    assert categories.max() == 8 and len(categories) == 7462 + 1, 'Wrong number of different hands.'
+
+    # Some hands we know
+    royal_flush = [cards.Card(v, 'spades').code for v in [1, 13, 12, 11, 10]]
+    wheel = [cards.Card(1, 'hearts').code] + [cards.Card(v, 'clubs').code for v in [2, 3, 4, 5]]
+    six_high = [cards.Card(v, 'clubs').code for v in [2, 3, 4, 5]] + [cards.Card(6, 'hearts').code]
+    assert evaluate([royal_flush])[0] == 7462
+    assert list(category_names(evaluate([wheel, six_high]))) == ['straight', 'straight']
+    assert evaluate([six_high])[0] == evaluate([wheel])[0] + 1
+
+    # Random hands: same order as naive_rank()
+    hands = cards.deal_hands(20000, number_of_players=1, cards_per_hand=5, rng=0)[:, 0]
+    scores = evaluate(hands)
+    ranked = [naive_rank(hand) for hand in cards.to_cards(hands)]
+    order = sorted(range(len(ranked)), key=lambda i: ranked[i])
+    assert (np.diff(scores[order].astype(int)) >= 0).all(), 'Scores in the wrong order.'
+    for i, j in zip(order[:-1], order[1:]):
+        assert (ranked[i] == ranked[j]) == (scores[i] == scores[j]), 'Wrong ties.'
+
+    # 7 cards: best of the 21 5-card hands
+    hands = cards.deal_hands(500, number_of_players=1, cards_per_hand=7, rng=1)[:, 0]
+    best = [max(naive_rank(cards.to_cards(hand[list(five)])) for five in itertools.combinations(range(7), 5))
+            for hand in hands]
+    assert list(category_names(evaluate(hands))) == [CATEGORIES[b[0]] for b in best]
+    print('Test passed.')
+
+
+def benchmark_evaluators(number_of_hands=1_000_000, number_of_naive_hands=100_000, seed=42):
+    '''
+    Print how many hands per second the lookup tables and naive_rank() can rank.
+    '''
+    load_tables()
+    hands = cards.deal_hands(number_of_hands, number_of_players=1, cards_per_hand=5, rng=seed)[:, 0]
+
+    start = time.perf_counter()
+    evaluate(hands)
+    vectorised_time = time.perf_counter() - start
+
+    # naive_rank() needs Card objects, making them counts as part of its time
+    start = time.perf_counter()
+    for hand in hands[:number_of_naive_hands]:
+        naive_rank([cards.Card.from_code(code) for code in hand])
+    naive_time = time.perf_counter() - start
+
+    vectorised_speed = number_of_hands / vectorised_time
+    naive_speed = number_of_naive_hands / naive_time
+    print(f'Lookup tables: {vectorised_speed:,.0f} hands/s')
+    print(f'naive_rank():  {naive_speed:,.0f} hands/s')
+    print(f'Speed-up: {vectorised_speed / naive_speed:.0f}x')
+
+
+if __name__ == '__main__':
+    # How often does each hand come up?
+    hands = cards.deal_hands(1_000_000, number_of_players=1, cards_per_hand=5)[:, 0]
+    counts = Counter(category_names(evaluate(hands)))
+    for category in CATEGORIES:
+        print(f'{category}: {counts[category] / len(hands):.6f}')
+
+    # benchmark_evaluators()